@@ -22,50 +22,111 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import tkinter
-from window import Window
-from interpreter import Interpreter
-from renderer import Renderer
-from file_io import FileIO
-from keymap import Keymap
-from audio import AudioSynthesizer
+import argparse
+import threading
 
 copyright_frame = None
 
 def show_copyright(root, width, height):
+    import tkinter
     copyright_frame = tkinter.Toplevel(root, width=width, height=height)
     copyright_frame.title("Copyright Info")
     label = tkinter.Label(copyright_frame, text="Copyright 2020, Chris Bell", fg="red")
     label.pack();
     copyright_frame.protocol("WM_DELETE_WINDOW", copyright_frame.destroy)
 
+def export_profile(profiler, lock):
+    from tkinter import filedialog
+    filename = filedialog.asksaveasfilename(title='Export profile', defaultextension='.json')
+    if isinstance(filename, str) and filename:
+        with lock:
+            profiler.export(filename)
+
+def synchronized(lock, function):
+    """Wraps a menu command which touches the interpreter, so it waits for the emulation thread's current frame"""
+    def command(*args):
+        with lock:
+            return function(*args)
+    return command
+
 def main():
+    parser = argparse.ArgumentParser(description='Chip-8 Emulator')
+    parser.add_argument('--renderer', choices=['mesh', 'texture'], default='mesh',
+                        help='draw pixels as a quad mesh or as a single textured quad')
+    parser.add_argument('--clock-rate', type=int, default=600, help='instructions per second')
+    parser.add_argument('--min-cycles', type=int, default=10,
+                        help='fewest instructions a frame runs when the host can\'t keep up')
+    parser.add_argument('--max-cycles', type=int, default=100000,
+                        help='most instructions a frame runs, also the budget when the CPU is unlimited')
+    parser.add_argument('--debug', action='store_true', help='print key and audio events')
+    parser.add_argument('--rewind-memory', type=float, default=8, help='megabytes of rewind history to keep')
+    parser.add_argument('--library', help='ROM library directory (default: ~/.chip8/library)')
+    args = parser.parse_args()
+
+    # The GUI backends pull in Tk, OpenGL and the audio libraries, they're only imported once the arguments are valid
+    import tkinter
+    from window import Window
+    from interpreter import Interpreter
+    from renderer import Renderer, TextureRenderer
+    from file_io import FileIO
+    from keymap import Keymap
+    from audio import AudioSynthesizer
+    from scheduler import Scheduler, CycleController
+    from rewind import RewindBuffer
+    from profiler import Profiler
+    from rom_library import RomLibrary
+    from emulation import EmulationThread
+    from headless import NullDisplay
 
     root = tkinter.Tk()
     root.resizable(False, False)
 
     # OpenGL display
-    display = Renderer()
+    if args.renderer == 'texture':
+        display = TextureRenderer()
+    else:
+        display = Renderer()
 
     # Keymap/Input
     keymap = Keymap(root)
+    keymap.debug = args.debug
     root.bind('<KeyPress>', keymap.process_keypress)
     root.bind('<KeyRelease>', keymap.process_keyrelease)
 
     # Audio synthesizer
     audio = AudioSynthesizer()
+    audio.debug = args.debug
+
+    # Chip-8 interpreter, it keeps the framebuffer and the window draws copies of it
+    interpreter = Interpreter(NullDisplay(), keymap, audio, debug=args.debug)
+
+    # Runs the interpreter in step with the wall clock, with no more instructions per frame than the host has time for
+    controller = CycleController(min_cycles=args.min_cycles, max_cycles=args.max_cycles)
+    scheduler = Scheduler(interpreter, clock_rate=args.clock_rate, controller=controller)
+
+    # History of recent frames, played backwards while backspace is held
+    rewind = RewindBuffer(memory_limit=int(args.rewind_memory * 1024 * 1024))
 
-    # Chip-8 interpreter
-    interpreter = Interpreter(display, keymap, audio)
+    # Opcode statistics, only collected while attached
+    profiler = Profiler(interpreter, controller)
+
+    # Known ROMs with their preferred settings and saved analysis
+    library = RomLibrary(args.library)
+
+    # Held by whichever thread is using the interpreter
+    lock = threading.Lock()
 
     # File manager
-    file_io = FileIO(interpreter)
+    file_io = FileIO(interpreter, scheduler, library, lock)
+
+    # Runs the interpreter on its own thread, completed frames are handed to the window
+    emulation = EmulationThread(interpreter, scheduler, rewind, file_io, lock)
 
     # Setup the main window frame
-    window = Window(root, display, interpreter, file_io, keymap, audio, width=720, height=480)
-    # Approximate milliseconds between update calls
-    window.animate = int(1000 / display.max_fps)
+    window = Window(root, display, interpreter, file_io, keymap, audio, emulation, profiler, width=720, height=480)
     window.pack(fill=tkinter.BOTH, expand=False)
+    root.bind('<KeyPress-BackSpace>', window.start_rewind)
+    root.bind('<KeyRelease-BackSpace>', window.stop_rewind)
 
     # Menu bar
     menu_bar = tkinter.Menu(root)
@@ -73,6 +134,8 @@ def main():
     file_menu.add_command(label="Open ROM...", command=file_io.open)
     file_menu.add_command(label="Save state...", command=file_io.save_state)
     file_menu.add_command(label="Load state...", command=file_io.load_state)
+    file_menu.add_command(label="Record movie", command=file_io.start_recording)
+    file_menu.add_command(label="Stop recording...", command=file_io.stop_recording)
     file_menu.add_command(label="Keyboard settings...", command=keymap.open_window)
     file_menu.add_command(label="About...", command=lambda: show_copyright(root, 720, 480))
 
@@ -81,6 +144,23 @@ def main():
     file_menu.add_command(label="Quit", command=window.close)
     menu_bar.add_cascade(label="File", menu=file_menu)
 
+    emulation_menu = tkinter.Menu(menu_bar, tearoff=0)
+    for clock_rate in [500, 1000, 2000]:
+        emulation_menu.add_command(label="CPU " + str(clock_rate) + " Hz",
+                                   command=lambda rate=clock_rate: file_io.set_clock_rate(rate))
+    emulation_menu.add_command(label="CPU unlimited", command=lambda: file_io.set_clock_rate(None))
+    emulation_menu.add_separator()
+    for speed in [1, 2, 4, 8]:
+        emulation_menu.add_command(label="Speed " + str(speed) + "x",
+                                   command=synchronized(lock, lambda multiplier=speed: scheduler.set_speed(multiplier)))
+    emulation_menu.add_separator()
+    profiling = tkinter.BooleanVar(root, False)
+    emulation_menu.add_checkbutton(label="Profile", variable=profiling,
+                                   command=synchronized(lock, lambda: profiler.attach() if profiling.get()
+                                                        else profiler.detach()))
+    emulation_menu.add_command(label="Export profile...", command=lambda: export_profile(profiler, lock))
+    menu_bar.add_cascade(label="Emulation", menu=emulation_menu)
+
     root.config(menu=menu_bar)
 
     root.protocol("WM_DELETE_WINDOW", window.close)
@@ -89,6 +169,7 @@ def main():
         # Show GPU info
         window.after(100, window.printContext)
 
+    emulation.start()
     window.mainloop()
 
 
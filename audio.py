@@ -24,27 +24,55 @@ SOFTWARE.
 
 import simpleaudio
 import numpy as np
-from math import ceil
-from scipy import signal
+import threading
+
 
 class AudioSynthesizer:
     def __init__(self):
+        """Plays a square wave in the background while the sound timer is active"""
         # Frequency in Hz
         self.frequency = 100
         self.rate = 44100
+        # Length of each buffer handed to the audio device, also the latency of stopping the tone
+        self.chunk_duration = 0.05
+
+        # One period of the square wave at full volume, computed once
+        period = int(self.rate / self.frequency)
+        self.period = np.where(np.arange(period) < period // 2, 0x7FFF, -0x7FFF).astype(np.int16)
+        # Whole number of periods covering a chunk, so consecutive chunks join without clicks
+        periods = max(1, round(self.chunk_duration * self.rate / period))
+        self.chunk = np.tile(self.period, periods)
+
+        # Set while the tone should be playing
+        self.tone = threading.Event()
+        self.running = True
+        self.thread = None
+
+        # Debug mode, prints when the tone starts and stops
+        self.debug = False
+
+    def set_tone(self, on):
+        """Starts or stops the tone without blocking the caller"""
+        if self.debug and on != self.tone.is_set():
+            print('Tone on' if on else 'Tone off')
+        if on:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.stream, name='audio', daemon=True)
+                self.thread.start()
+            self.tone.set()
+        else:
+            self.tone.clear()
+
+    def stream(self):
+        """Audio thread, keeps queueing chunks while the tone is on"""
+        while self.running:
+            self.tone.wait()
+            if not self.running:
+                break
+            play_obj = simpleaudio.play_buffer(self.chunk, 1, 2, self.rate)
+            play_obj.wait_done()
 
-    def play_square_wave(self, duration):
-        # Make sure number of samples for linspace is at least 1
-        if duration <= 0:
-            return
-        samples = np.linspace(0, ceil(duration), ceil(duration) * self.rate, False)
-        audio_array = signal.square(2 * np.pi * self.frequency * samples)
-        # Use a fractional duration
-        if duration < 1:
-            max_index = int(len(audio_array) * duration)
-            audio_array = audio_array[:max_index]
-        # Constrain audio data to size of data type
-        audio_array *= int(0xFFFF / 2) / np.max(np.abs(audio_array))
-        audio_array = audio_array.astype(np.int16)
-        play_obj = simpleaudio.play_buffer(audio_array, 1, 2, self.rate)
-        play_obj.wait_done()
\ No newline at end of file
+    def close(self):
+        self.running = False
+        # Wake the audio thread so that it can exit
+        self.tone.set()
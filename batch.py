@@ -0,0 +1,219 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import headless
+import movie
+
+# File extensions picked up when a directory is given
+rom_extensions = ('.ch8', '.c8', '.rom')
+# Extension of the replay used for a ROM found in a directory
+movie_extension = '.c8m'
+
+
+def find_roms(directory):
+    """Returns (rom, movie) pairs for every ROM below the directory, a movie next to a ROM with the same name is
+    replayed instead of running for a fixed budget. """
+    jobs = []
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in rom_extensions:
+                rom = os.path.join(root, name)
+                replay = os.path.splitext(rom)[0] + movie_extension
+                jobs.append((rom, replay if os.path.isfile(replay) else None))
+    return jobs
+
+
+def read_manifest(filename):
+    """Returns (rom, movie) pairs from a manifest which lists a ROM and optionally a movie on each line. Paths are
+    relative to the manifest, blank lines and lines starting with # are ignored. """
+    base = os.path.dirname(filename)
+    jobs = []
+    with open(filename) as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            replay = os.path.join(base, fields[1]) if len(fields) > 1 else None
+            jobs.append((os.path.join(base, fields[0]), replay))
+    return jobs
+
+
+def run_job(job):
+    """Runs a single ROM in a worker process, every failure is reported in the result instead of raised"""
+    rom, replay, settings = job
+    result = {
+        'rom': rom,
+        'movie': replay,
+        'status': 'ok',
+        'errors': [],
+        'instructions': 0,
+        'instructions_skipped': 0,
+        'seconds': 0.0,
+        'instructions_per_second': 0.0,
+        'framebuffer_hash': None,
+    }
+    try:
+        player = None
+        if replay is not None:
+            with open(replay, 'rb') as file:
+                player = movie.MoviePlayer(movie.decode(file.read()))
+        interpreter = headless.create_interpreter(player, settings['engine'], settings['seed'])
+        interpreter.clock_rate = settings['clock_rate']
+        with open(rom, 'rb') as file:
+            interpreter.load_program_to_memory(file)
+        if player is not None and not interpreter.error:
+            player.start(interpreter)
+
+        # The deadline is checked between frames, a frame is only clock_rate / 60 instructions
+        deadline = time.perf_counter() + settings['timeout']
+        start = time.perf_counter()
+        frames = 0
+        while not interpreter.error:
+            if player is not None:
+                if player.finished():
+                    break
+                player.run_frame(interpreter)
+            else:
+                if settings['frames'] is not None and frames >= settings['frames']:
+                    break
+                if settings['instructions'] is not None and interpreter.instruction_count >= settings['instructions']:
+                    break
+                interpreter.run_frame()
+                # Nothing can release an Fx0A once the key script has run out, an instruction budget would only be
+                # spent by the timeout. Stops like headless.run.
+                keyboard = interpreter.keyboard
+                if (settings['instructions'] is not None and interpreter.wait_for_key and not keyboard.keydown and
+                        keyboard.finished()):
+                    result['status'] = 'waiting for key'
+                    break
+            frames += 1
+            if time.perf_counter() > deadline:
+                result['status'] = 'timeout'
+                break
+        elapsed = time.perf_counter() - start
+
+        result['errors'] = interpreter.errors
+        if interpreter.error:
+            result['status'] = 'error'
+        result['instructions'] = interpreter.instruction_count
+        result['instructions_skipped'] = interpreter.idle_cycles
+        result['seconds'] = elapsed
+        # Skipped idle loops take no time, the speed only counts instructions which actually ran
+        executed = interpreter.instruction_count - interpreter.idle_cycles
+        result['instructions_per_second'] = executed / elapsed if elapsed > 0 else 0.0
+        result['framebuffer_hash'] = interpreter.framebuffer.hash()
+        if player is not None:
+            result['replay_matches'] = movie.framebuffer_digest(interpreter) == player.movie.final_digest
+            if result['status'] == 'ok' and not result['replay_matches']:
+                result['status'] = 'desync'
+    except Exception:
+        # Crashes in one ROM mustn't take the rest of the batch down
+        result['status'] = 'crash'
+        result['errors'].append(traceback.format_exc(limit=-1).strip())
+    return result
+
+
+def run_batch(jobs, settings, processes=None):
+    """Runs every job across a process pool, returns the results in job order"""
+    # Workers are replaced after every ROM, so one which dies or leaks can't affect the next
+    with multiprocessing.Pool(processes or os.cpu_count(), maxtasksperchild=1) as pool:
+        pending = [pool.apply_async(run_job, [(rom, replay, settings)]) for rom, replay in jobs]
+        results = []
+        for (rom, replay), async_result in zip(jobs, pending):
+            # Jobs start in order, so by now this one is running and enforces its own deadline. A worker that
+            # died never answers.
+            try:
+                results.append(async_result.get(settings['timeout'] + 30))
+            except multiprocessing.TimeoutError:
+                results.append({'rom': rom, 'movie': replay, 'status': 'crash',
+                                'errors': ['Worker stopped responding'], 'instructions': 0, 'instructions_skipped': 0,
+                                'seconds': 0.0, 'instructions_per_second': 0.0, 'framebuffer_hash': None})
+        pool.terminate()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m batch', description='Run many Chip-8 ROMs headlessly')
+    parser.add_argument('source', help='directory to search for ROMs, or a manifest listing a ROM and optional movie '
+                                       'per line')
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument('-i', '--instructions', type=int, help='number of instructions to execute per ROM')
+    budget.add_argument('-f', '--frames', type=int, help='number of frames to execute per ROM')
+    parser.add_argument('-c', '--clock-rate', type=int, default=600, help='instructions per second of emulated time')
+    parser.add_argument('-e', '--engine', choices=headless.engines, default='interpreter', help='execution engine to use')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed for the Cxkk random number generator')
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes (default: number of cores)')
+    parser.add_argument('-t', '--timeout', type=float, default=60, help='seconds allowed per ROM')
+    parser.add_argument('-o', '--output', help='write the report to a JSON file')
+    args = parser.parse_args(argv)
+    if args.instructions is None and args.frames is None:
+        args.frames = 600
+
+    try:
+        if os.path.isdir(args.source):
+            jobs = find_roms(args.source)
+        else:
+            jobs = read_manifest(args.source)
+    except IOError as error:
+        print("Couldn't read manifest: " + str(error), file=sys.stderr)
+        return 1
+
+    settings = {
+        'instructions': args.instructions,
+        'frames': args.frames,
+        'clock_rate': args.clock_rate,
+        'engine': args.engine,
+        'seed': args.seed,
+        'timeout': args.timeout,
+    }
+    start = time.perf_counter()
+    results = run_batch(jobs, settings, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    print("%-15s %12s %-40s %s" % ("Status", "Instr/s", "Framebuffer hash", "ROM"))
+    for result in results:
+        print("%-15s %12.0f %-40s %s" % (result['status'], result['instructions_per_second'],
+                                        result['framebuffer_hash'] or '-', result['rom']))
+        for error in result['errors']:
+            print("  " + error.splitlines()[-1])
+    # A ROM stopped waiting for a key ran as far as it could without input
+    failed = sum(1 for result in results if result['status'] not in ('ok', 'waiting for key'))
+    print("%d ROMs, %d failed, %.1f seconds" % (len(results), failed, elapsed))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'settings': settings, 'seconds': elapsed, 'results': results}, file, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import headless
+
+
+def words(*opcodes):
+    return b''.join(opcode.to_bytes(2, 'big') for opcode in opcodes)
+
+
+def assemble(sections):
+    """Builds a ROM from {address: bytes} sections, gaps are filled with zeros"""
+    end = max(address + len(data) for address, data in sections.items())
+    rom = bytearray(end - 0x200)
+    for address, data in sections.items():
+        rom[address - 0x200:address - 0x200 + len(data)] = data
+    return bytes(rom)
+
+
+def call_chain(depth):
+    """Calls nested depth subroutines deep from a loop at 0x200, each subroutine is 16 bytes apart"""
+    sections = {0x200: words(0x2300, 0x1200)}
+    for level in range(depth - 1):
+        sections[0x300 + level * 0x10] = words(0x2310 + level * 0x10, 0x00EE)
+    sections[0x300 + (depth - 1) * 0x10] = words(0x8014, 0x00EE)
+    return sections
+
+
+# Synthetic ROMs, each one loops forever over the path it stresses
+workloads = {
+    # Every 8xy* operation on changing values
+    'alu': {0x200: words(0x6001, 0x6103, 0x8014, 0x8015, 0x8011, 0x8012, 0x8013, 0x8016, 0x8017, 0x801E,
+                         0x8010, 0x7105, 0x1204)},
+    # 15 row sprites at random positions
+    'sprites': {0x200: words(0xA300, 0xC03F, 0xC11F, 0xD01F, 0x1202),
+                0x300: bytes([0xFF, 0x81, 0xBD, 0xA5, 0xA5, 0xBD, 0x81, 0xFF, 0x81, 0xBD, 0xA5, 0xA5, 0xBD, 0x81,
+                              0xFF])},
+    # A clear after every font sprite
+    'clears': {0x200: words(0x00E0, 0xA000, 0xD015, 0x1200)},
+    # Fx55/Fx65 over all registers at a moving address
+    'memory': {0x200: words(0xA400, 0xFF55, 0xF01E, 0xFF65, 0x7001, 0x1200)},
+    # Subroutines nested 8 deep
+    'calls': call_chain(8),
+    # SUPER-CHIP high resolution mode, 16x16 sprites at random positions and a scroll after each one
+    'hires': {0x200: words(0x00FF, 0xA300, 0xC07F, 0xC13F, 0xD010, 0x00C1, 0x00FB, 0x1202),
+              0x300: bytes([0xFF, 0xFF, 0x80, 0x01, 0xBF, 0xFD, 0xA0, 0x05, 0xAF, 0xF5, 0xA8, 0x15, 0xAB, 0xD5, 0xAA,
+                            0x55, 0xAA, 0x55, 0xAB, 0xD5, 0xA8, 0x15, 0xAF, 0xF5, 0xA0, 0x05, 0xBF, 0xFD, 0x80, 0x01,
+                            0xFF, 0xFF])},
+    # Busy waits for the delay timer, like most games between frames
+    'timers': {0x200: words(0x6002, 0xF015, 0xF107, 0x3100, 0x1204, 0x7201, 0x1200)},
+}
+
+# Display paths each workload runs through: no display, or the CPU side of a renderer's upload path
+paths = ['headless', 'mesh', 'texture']
+
+
+def create_display(path):
+    """Returns the display for a path and a function which ends its frame, or None if it can't be created"""
+    if path == 'headless':
+        return headless.NullDisplay(), lambda: None
+    try:
+        import renderer
+    except ImportError:
+        return None
+    # There's no OpenGL context, the buffers are prepared for upload and then marked clean as a flush would
+    if path == 'mesh':
+        display = renderer.Renderer()
+        return display, display.dirty_rows.clear
+    display = renderer.TextureRenderer()
+
+    def end_frame():
+        display.dirty = False
+    return display, end_frame
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_workload(sections, path, frames, clock_rate, engine, allocation_frames=60):
+    """Runs a workload for the given number of frames, returns its statistics or None if the path is unavailable"""
+    created = create_display(path)
+    if created is None:
+        return None
+    display, end_frame = created
+    interpreter = headless.create_interpreter(engine=engine, seed=0, display=display)
+    interpreter.clock_rate = clock_rate
+    interpreter.load_program_to_memory(io.BytesIO(assemble(sections)))
+
+    frame_times = []
+    start = time.perf_counter()
+    for i in range(frames):
+        frame_start = time.perf_counter()
+        interpreter.run_frame()
+        end_frame()
+        frame_times.append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+    # Skipped idle loops cost nothing, the speed only counts instructions which actually ran
+    skipped = interpreter.idle_cycles
+    executed = interpreter.instruction_count - skipped
+
+    # Allocations are measured separately, tracing slows everything down
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    for i in range(allocation_frames):
+        interpreter.run_frame()
+        end_frame()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    retained_blocks = sys.getallocatedblocks() - blocks
+
+    frame_times.sort()
+    return {
+        'instructions_per_second': executed / elapsed if elapsed > 0 else 0.0,
+        'instructions_executed': executed,
+        'instructions_skipped': skipped,
+        'frame_ms': {name: percentile(frame_times, fraction) * 1000
+                     for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]},
+        'peak_allocated_kib': peak / 1024,
+        'retained_blocks': retained_blocks,
+        'errors': interpreter.errors,
+    }
+
+
+def run_suite(names, selected_paths, frames, clock_rate, engine):
+    results = {}
+    for name in names:
+        results[name] = {}
+        for path in selected_paths:
+            result = run_workload(workloads[name], path, frames, clock_rate, engine)
+            if result is not None:
+                results[name][path] = result
+    return results
+
+
+# Imports every GUI backend and builds the CPU side of the display, everything the window does before it opens
+gui_startup = """
+import tkinter, window, renderer, file_io, keymap, audio, scheduler, rewind, profiler, rom_library
+from interpreter import Interpreter
+display = renderer.Renderer()
+display.vertex_buffer = renderer.quad_mesh(display.width, display.height)
+Interpreter(display, None, None)
+"""
+
+# Cold start limits in milliseconds, from launching Python to the end of the first frame
+startup_budgets = {'headless': 100}
+
+
+def measure_startup(repeats=10):
+    """Launches each mode in a fresh Python process repeats times, returns the median and fastest start in
+    milliseconds, or None for a mode whose dependencies aren't installed"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.NamedTemporaryFile(suffix='.ch8', delete=False) as file:
+        file.write(assemble(workloads['alu']))
+    commands = {
+        'headless': [sys.executable, '-m', 'headless', file.name, '--frames', '1'],
+        'gui': [sys.executable, '-c', gui_startup],
+    }
+    results = {}
+    try:
+        for mode, command in commands.items():
+            # The first launch writes the bytecode caches, it isn't counted
+            if subprocess.run(command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode:
+                results[mode] = None
+                continue
+            times = []
+            for i in range(repeats):
+                start = time.perf_counter()
+                subprocess.run(command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                times.append((time.perf_counter() - start) * 1000)
+            times.sort()
+            results[mode] = {'p50_ms': percentile(times, 0.5), 'min_ms': times[0]}
+    finally:
+        os.remove(file.name)
+    return results
+
+
+def mismatched_settings(baseline, settings):
+    """Names of the settings the baseline was run with which differ from the given ones"""
+    return [name for name, value in sorted(settings.items()) if baseline.get(name) != value]
+
+
+def compare(results, baseline, threshold):
+    """Returns a line for every workload which got slower than the baseline by more than the threshold"""
+    regressions = []
+    for name, baseline_paths in baseline.get('results', {}).items():
+        for path, old in baseline_paths.items():
+            new = results.get(name, {}).get(path)
+            if new is None:
+                continue
+            # A baseline which ran nothing can't be slowed down
+            old_speed = old['instructions_per_second']
+            speed = new['instructions_per_second'] / old_speed - 1 if old_speed else 0.0
+            if speed < -threshold:
+                regressions.append("%s/%s instructions/second %+.1f%%" % (name, path, speed * 100))
+            frame_time = new['frame_ms']['p99'] / old['frame_ms']['p99'] - 1 if old['frame_ms']['p99'] else 0.0
+            if frame_time > threshold:
+                regressions.append("%s/%s p99 frame time %+.1f%%" % (name, path, frame_time * 100))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Benchmark synthetic Chip-8 workloads')
+    parser.add_argument('-w', '--workload', action='append', choices=sorted(workloads),
+                        help='workload to run, may be repeated (default: all)')
+    parser.add_argument('-p', '--path', action='append', choices=paths,
+                        help='display path to run through, may be repeated (default: all)')
+    parser.add_argument('-f', '--frames', type=int, default=600, help='frames to run per workload')
+    parser.add_argument('-c', '--clock-rate', type=int, default=60000, help='instructions per second of emulated time')
+    parser.add_argument('-e', '--engine', choices=headless.engines, default='interpreter')
+    parser.add_argument('-o', '--output', help='write the results to a JSON file')
+    parser.add_argument('-b', '--baseline', help='compare against results from a previous run')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression (default: 0.1)')
+    parser.add_argument('-s', '--startup', action='store_true',
+                        help='measure cold start times of the headless runner and the GUI instead of the workloads')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        return startup_main(args)
+
+    baseline = None
+    if args.baseline is not None:
+        try:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        except (IOError, ValueError) as error:
+            print("Couldn't read baseline: " + str(error), file=sys.stderr)
+            return 1
+        # Results from another engine or clock rate aren't comparable
+        mismatched = mismatched_settings(baseline, {'engine': args.engine, 'clock_rate': args.clock_rate})
+        if mismatched:
+            print("Baseline was run with a different " + ", ".join(
+                "%s (%s)" % (name, baseline.get(name)) for name in mismatched), file=sys.stderr)
+            return 1
+
+    results = run_suite(args.workload or sorted(workloads), args.path or paths, args.frames, args.clock_rate,
+                        args.engine)
+
+    print("%-10s %-9s %12s %12s %9s %9s %9s %10s" % ("Workload", "Path", "Instr/s", "Skipped", "p50 ms", "p90 ms",
+                                                     "p99 ms", "Peak KiB"))
+    for name, path_results in results.items():
+        for path, result in path_results.items():
+            frame_ms = result['frame_ms']
+            print("%-10s %-9s %12.0f %12d %9.3f %9.3f %9.3f %10.1f" % (
+                name, path, result['instructions_per_second'], result['instructions_skipped'], frame_ms['p50'],
+                frame_ms['p90'], frame_ms['p99'], result['peak_allocated_kib']))
+            for error in result['errors']:
+                print("  " + error, file=sys.stderr)
+
+    if args.output is not None:
+        report = {
+            'python': platform.python_version(),
+            'engine': args.engine,
+            'frames': args.frames,
+            'clock_rate': args.clock_rate,
+            'results': results,
+        }
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            return 1
+        print("No regressions against " + args.baseline)
+    return 0
+
+
+def startup_main(args):
+    startup = measure_startup()
+    print("%-10s %9s %9s %9s" % ("Mode", "p50 ms", "Min ms", "Budget"))
+    over_budget = []
+    for mode, result in startup.items():
+        budget = startup_budgets.get(mode)
+        if result is None:
+            print("%-10s %9s %9s %9s" % (mode, '-', '-', budget or '-') + "  dependencies missing")
+            continue
+        print("%-10s %9.1f %9.1f %9s" % (mode, result['p50_ms'], result['min_ms'], budget or '-'))
+        if budget is not None and result['p50_ms'] > budget:
+            over_budget.append(mode)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'python': platform.python_version(), 'startup': startup}, file, indent=2)
+    for mode in over_budget:
+        print("Over budget: %s cold start %.1f ms > %d ms" % (mode, startup[mode]['p50_ms'], startup_budgets[mode]))
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+import time
+import traceback
+import savestate
+from framebuffer import Framebuffer
+
+
+class Frame:
+    def __init__(self):
+        """A completed frame handed from the emulation thread to the UI thread"""
+        # Copy of the interpreter's screen
+        self.framebuffer = Framebuffer()
+        # Increases with every published frame, 0 is never published
+        self.sequence = 0
+        # Interpreter frame count when the frame was published
+        self.frame_count = 0
+
+
+class TripleBuffer:
+    def __init__(self):
+        """Passes frames from one writer thread to one reader thread. The writer fills the back frame and publishes
+        it, the reader takes the newest published frame. Only the exchange with the spare frame is locked, so neither
+        side waits while the other copies or draws. """
+        # Only touched by the writer
+        self.back = Frame()
+        # Only touched by the reader
+        self.front = Frame()
+        # The spare frame, only exchanged while holding the lock so a frame is only ever held by one side
+        self.middle = Frame()
+        self.lock = threading.Lock()
+        # Whether the spare frame was published since the reader last took it
+        self.fresh = False
+        # Sequence number of the newest published frame
+        self.published = 0
+
+    def publish(self, framebuffer, frame_count):
+        """Copies the framebuffer into the back frame and makes it the newest frame"""
+        back = self.back
+        if back.framebuffer.width != framebuffer.width or back.framebuffer.height != framebuffer.height:
+            back.framebuffer = Framebuffer(framebuffer.width, framebuffer.height)
+        back.framebuffer.buffer[:] = framebuffer.buffer
+        back.frame_count = frame_count
+        back.sequence = self.published + 1
+        with self.lock:
+            self.back = self.middle
+            self.middle = back
+            self.fresh = True
+        self.published = back.sequence
+
+    def latest(self):
+        """Returns the newest published frame, or None if there's nothing newer than the last one returned"""
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.front, self.middle = self.middle, self.front
+            self.fresh = False
+        return self.front
+
+
+class EmulationThread:
+    def __init__(self, interpreter, scheduler, rewind, file_io, lock):
+        """Runs the interpreter against the wall clock on its own thread and publishes every completed frame to a
+        triple buffer. Anything else which touches the interpreter has to hold the lock. """
+        self.interpreter = interpreter
+        self.scheduler = scheduler
+        self.rewind = rewind
+        self.file_io = file_io
+
+        # Completed frames for the display
+        self.frames = TripleBuffer()
+        # Held while a frame runs, the UI holds it while loading ROMs and states
+        self.lock = lock
+
+        # Set by the UI while the rewind key is held down
+        self.rewinding = False
+        # ROM the rewind history belongs to
+        self.rewind_rom = None
+        # Seconds to sleep while no ROM is running
+        self.idle_period = 1 / 60
+
+        # Framebuffer which was last published, loading a ROM or a state replaces it with one that's always shown
+        self.published_framebuffer = None
+
+        # Statistics
+        self.frames_published = 0
+
+        # Description of the exception which stopped the current ROM, None while it runs
+        self.failure = None
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='emulation', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """Emulation thread"""
+        while self.running:
+            with self.lock:
+                try:
+                    delay = self.update()
+                except Exception as exception:
+                    # The ROM stops as it would after a ROM error, the thread carries on so another one can be loaded
+                    traceback.print_exc()
+                    self.interpreter.error = True
+                    self.failure = '%s: %s' % (type(exception).__name__, exception)
+                    delay = self.idle_period
+            time.sleep(delay)
+
+    def update(self):
+        """Runs whatever is due and publishes the result, returns the seconds until something is due again"""
+        interpreter = self.interpreter
+        if not self.file_io.file_open or interpreter.error:
+            # Something may have been loaded, show it even if it doesn't run
+            self.publish()
+            self.scheduler.reset()
+            return self.idle_period
+        # Loading a ROM or a state clears the error flag, so whatever failed before was replaced
+        self.failure = None
+        if self.rewind_rom != interpreter.rom_hash:
+            # A different ROM was opened
+            self.rewind.clear()
+            self.rewind_rom = interpreter.rom_hash
+        if self.rewinding:
+            state = self.rewind.step_back()
+            if state is not None:
+                savestate.load(interpreter, state)
+            self.scheduler.reset()
+            self.publish()
+            return self.scheduler.frame_period()
+        if self.scheduler.update():
+            self.rewind.capture(savestate.save(interpreter))
+            self.publish()
+        return self.scheduler.delay() / 1000
+
+    def publish(self):
+        """Hands the screen to the display if anything was drawn since it was last published"""
+        framebuffer = self.interpreter.framebuffer
+        if framebuffer is self.published_framebuffer and not framebuffer.damaged:
+            return
+        framebuffer.damaged = False
+        self.published_framebuffer = framebuffer
+        self.frames.publish(framebuffer, self.interpreter.frame_count)
+        self.frames_published += 1
+
+    def statistics(self):
+        """Counters behind the emulation and display rates, read from any thread"""
+        return {
+            'frames_run': self.scheduler.frames_run,
+            'frames_dropped': self.scheduler.frames_dropped,
+            'frames_published': self.frames_published,
+            'cycles_per_frame': self.scheduler.controller.cycles,
+            'limited': self.scheduler.limited,
+            'failure': self.failure,
+        }
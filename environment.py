@@ -0,0 +1,140 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import io
+import numpy as np
+import headless
+import savestate
+from vector_engine import VectorEngine
+
+
+def action_key(action):
+    """The keypad only holds one key, the lowest key set in the action bitmask is pressed"""
+    action = int(action) & 0xFFFF
+    if not action:
+        return 0, False
+    return (action & -action).bit_length() - 1, True
+
+
+def unpack(observation):
+    """Expands packed framebuffer rows to one byte per pixel, (..., 32, 64). The result is a copy."""
+    if observation.dtype != np.uint8:
+        # Whole uint64 rows, big-endian bytes put the leftmost pixel first
+        rows = observation.astype('>u8')
+        observation = rows.view(np.uint8).reshape(rows.shape + (8,))
+    return np.unpackbits(observation, axis=-1)
+
+
+class Environment:
+    def __init__(self, program, frame_skip=4, clock_rate=600, engine='interpreter', reward=None):
+        """Reinforcement learning environment around a headless interpreter. Actions are 16-bit keypad bitmasks,
+        each step holds the action for frame_skip frames. Observations are read-only views of the packed
+        framebuffer, (32, 8) bytes with the leftmost pixel in the most significant bit. """
+        self.frame_skip = frame_skip
+        # Called with the environment after every step, Chip-8 has no notion of a score
+        self.reward = reward or (lambda environment: 0.0)
+
+        self.keypad = headless.ScriptedKeypad()
+        self.interpreter = headless.create_interpreter(self.keypad, engine)
+        self.interpreter.clock_rate = clock_rate
+        self.interpreter.load_program_to_memory(io.BytesIO(program))
+        # State right after loading, every reset goes back to it instead of loading the ROM again
+        self.snapshot = savestate.save(self.interpreter)
+        self.framebuffer = None
+        self.observation = None
+
+    def reset(self, seed=None):
+        """Restores the freshly loaded ROM and returns the first observation. A seed reseeds Cxkk, otherwise every
+        episode sees the same random numbers. """
+        savestate.load(self.interpreter, self.snapshot)
+        if seed is not None:
+            self.interpreter.random.seed(seed)
+        return self.observe()
+
+    def observe(self):
+        """Makes a view of the interpreter's current framebuffer the observation"""
+        # Loading a state or switching resolution installs a new framebuffer, views of the old one stop changing
+        self.framebuffer = self.interpreter.framebuffer
+        observation = np.frombuffer(self.framebuffer.buffer, np.uint8)
+        self.observation = observation.reshape(self.framebuffer.height, -1)
+        self.observation.flags.writeable = False
+        return self.observation
+
+    def step(self, action):
+        """Holds the keys for frame_skip frames, returns (observation, reward, done, info). The observation is the
+        same live view every step until the program switches resolution, copy it to keep a frame. """
+        if self.observation is None:
+            self.reset()
+        interpreter = self.interpreter
+        self.keypad.key, self.keypad.keydown = action_key(action)
+        for frame in range(self.frame_skip):
+            interpreter.run_frame()
+            if interpreter.error:
+                break
+        if interpreter.framebuffer is not self.framebuffer:
+            self.observe()
+        info = {'instructions': interpreter.instruction_count, 'frames': interpreter.frame_count}
+        return self.observation, self.reward(self), interpreter.error, info
+
+
+class VectorEnvironment:
+    def __init__(self, program, count, frame_skip=4, clock_rate=600, seed=0):
+        """Steps count environments per call on a VectorEngine. Observations are a read-only (count, 32) view of
+        the uint64 framebuffer rows, unpack turns them into pixels. """
+        self.count = count
+        self.frame_skip = frame_skip
+        self.engine = VectorEngine(count, seed, clock_rate)
+        self.engine.load_program(program)
+        # Copies of every array right after loading, restored in place so views stay valid
+        self.snapshot = {name: value.copy() for name, value in vars(self.engine).items()
+                         if isinstance(value, np.ndarray)}
+        self.random_states = [generator.getstate() for generator in self.engine.random]
+        self.observation = self.engine.framebuffer.view()
+        self.observation.flags.writeable = False
+
+    def reset(self, seed=None):
+        """Restores every environment to the freshly loaded ROM, a seed reseeds machine m with seed + m"""
+        engine = self.engine
+        for name, value in self.snapshot.items():
+            np.copyto(getattr(engine, name), value)
+        for machine, generator in enumerate(engine.random):
+            if seed is None:
+                generator.setstate(self.random_states[machine])
+            else:
+                generator.seed(seed + machine)
+        return self.observation
+
+    def step(self, actions):
+        """Applies one keypad bitmask per environment for frame_skip frames, returns (observations, rewards,
+        dones, info) arrays """
+        engine = self.engine
+        actions = np.asarray(actions, np.int64) & 0xFFFF
+        lowest = actions & -actions
+        engine.keydown[:] = lowest != 0
+        # Index of the lowest set bit, log2 is exact for powers of two
+        engine.key[:] = np.where(lowest != 0, np.log2(np.maximum(lowest, 1)).astype(np.int64), 0)
+        for frame in range(self.frame_skip):
+            engine.run_frame()
+        info = {'instructions': engine.instruction_count.copy()}
+        return self.observation, np.zeros(self.count), engine.error.copy(), info
@@ -24,15 +24,25 @@ SOFTWARE.
 
 from tkinter import filedialog, messagebox
 import ntpath
+import threading
+import savestate
+import movie
 
 
 class FileIO:
-    def __init__(self, interpreter):
+    def __init__(self, interpreter, scheduler=None, library=None, lock=None):
         """Class for handling reading/writing to files"""
         self.interpreter = interpreter
+        # Held while the interpreter is touched, it may be running on another thread
+        self.lock = lock or threading.Lock()
+        # ROMs are opened through the library when there is one, it remembers their titles and clock rates
+        self.scheduler = scheduler
+        self.library = library
         self.file_open = False
         self.rom = ''
         self.filename = ''
+        # Records keypad input while a movie is being recorded
+        self.recorder = None
         return
 
     def open(self):
@@ -41,10 +51,19 @@ class FileIO:
         if not isinstance(self.filename, str):
             return
         self.rom = ntpath.basename(self.filename)
+        self.stop_recording()
+        self.save_analysis()
         # Open in binary mode
         try:
-            with open(self.filename, 'rb') as file:
-                self.interpreter.load_program_to_memory(file)
+            with self.lock:
+                if self.library is not None:
+                    entry = self.library.open(self.interpreter, self.filename)
+                    self.rom = entry['title']
+                    if entry['clock_rate'] is not None and self.scheduler is not None:
+                        self.scheduler.set_clock_rate(entry['clock_rate'])
+                else:
+                    with open(self.filename, 'rb') as file:
+                        self.interpreter.load_program_to_memory(file)
                 self.file_open = True
         except IOError as error:
             if self.interpreter.debug:
@@ -52,10 +71,99 @@ class FileIO:
             messagebox.showerror("ROM Error", "Couldn't open file")
             self.file_open = False
 
+    def save_analysis(self):
+        """Keep what was decoded from the open ROM, so opening it again starts warm"""
+        if self.library is None or not self.file_open:
+            return
+        try:
+            with self.lock:
+                self.library.save_analysis(self.interpreter)
+        except IOError as error:
+            if self.interpreter.debug:
+                print(error)
+
+    def set_clock_rate(self, clock_rate):
+        """Change the clock rate and remember it for the open ROM"""
+        if self.scheduler is not None:
+            with self.lock:
+                self.scheduler.set_clock_rate(clock_rate)
+        if self.library is None or not self.file_open or clock_rate is None:
+            return
+        try:
+            self.library.update(self.interpreter.rom_hash.hex(), clock_rate=clock_rate)
+        except IOError as error:
+            if self.interpreter.debug:
+                print(error)
+
     def save_state(self):
         """Save the interpreter state"""
-        return
+        if not self.file_open:
+            messagebox.showerror("State Error", "Open a ROM before saving a state")
+            return
+        filename = filedialog.asksaveasfilename(title='Save state', defaultextension='.c8s',
+                                                initialfile=ntpath.splitext(self.rom)[0] + '.c8s')
+        if not isinstance(filename, str) or not filename:
+            return
+        with self.lock:
+            state = savestate.save(self.interpreter)
+        try:
+            with open(filename, 'wb') as file:
+                file.write(state)
+        except IOError as error:
+            if self.interpreter.debug:
+                print(error)
+            messagebox.showerror("State Error", "Couldn't write file")
 
     def load_state(self):
         """Load a saved interpreter state"""
-        return
+        if not self.file_open:
+            messagebox.showerror("State Error", "Open the ROM the state was saved with first")
+            return
+        filename = filedialog.askopenfilename(title='Load state', filetypes=[('Save states', '*.c8s'),
+                                                                              ('All files', '*')])
+        if not isinstance(filename, str) or not filename:
+            return
+        # A movie can't jump to another state, finish it first
+        self.stop_recording()
+        try:
+            with open(filename, 'rb') as file:
+                state = file.read()
+            with self.lock:
+                savestate.load(self.interpreter, state)
+        except IOError as error:
+            if self.interpreter.debug:
+                print(error)
+            messagebox.showerror("State Error", "Couldn't open file")
+        except savestate.SaveStateError as error:
+            messagebox.showerror("State Error", str(error))
+
+    def start_recording(self):
+        """Record keypad input from the current state until recording is stopped"""
+        if not self.file_open:
+            messagebox.showerror("Movie Error", "Open a ROM before recording a movie")
+            return
+        if self.recorder is not None:
+            return
+        with self.lock:
+            self.recorder = movie.MovieRecorder(self.interpreter, self.interpreter.keyboard)
+            self.interpreter.keyboard = self.recorder
+
+    def stop_recording(self):
+        """Stop recording and save the movie"""
+        if self.recorder is None:
+            return
+        with self.lock:
+            recording = self.recorder.stop()
+            self.interpreter.keyboard = self.recorder.keypad
+            self.recorder = None
+        filename = filedialog.asksaveasfilename(title='Save movie', defaultextension='.c8m',
+                                                initialfile=ntpath.splitext(self.rom)[0] + '.c8m')
+        if not isinstance(filename, str) or not filename:
+            return
+        try:
+            with open(filename, 'wb') as file:
+                file.write(movie.encode(recording))
+        except IOError as error:
+            if self.interpreter.debug:
+                print(error)
+            messagebox.showerror("Movie Error", "Couldn't write file")
@@ -0,0 +1,136 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+
+# Screen sizes of Chip-8's low resolution mode and SUPER-CHIP/XO-CHIP's high resolution mode
+LOW_RESOLUTION = (64, 32)
+HIGH_RESOLUTION = (128, 64)
+
+
+class Framebuffer:
+    def __init__(self, width=LOW_RESOLUTION[0], height=LOW_RESOLUTION[1]):
+        """Chip-8 screen stored as packed rows, the most significant bit of a row is its leftmost pixel. 64x32 for
+        Chip-8 and the low resolution mode, 128x64 for the SUPER-CHIP/XO-CHIP high resolution mode. """
+        self.width = width
+        self.height = height
+        # Each row is a big-endian word of width bits, rows are ordered from the top of the screen
+        self.row_bytes = width // 8
+        self.buffer = bytearray(self.row_bytes * height)
+        self.row_mask = (1 << width) - 1
+        # Set whenever a pixel changes, cleared by whoever presents the screen. A new screen has to be shown once.
+        self.damaged = True
+
+    def get_row(self, y):
+        """Gets row y as an integer"""
+        offset = y * self.row_bytes
+        return int.from_bytes(self.buffer[offset:offset + self.row_bytes], 'big')
+
+    def get_pixel(self, x, y):
+        """Gets the pixel at (x, y), where (0, 0) is the top left corner"""
+        return self.buffer[y * self.row_bytes + x // 8] >> (7 - x % 8) & 1
+
+    def clear(self):
+        if any(self.buffer):
+            self.buffer[:] = bytes(len(self.buffer))
+            self.damaged = True
+
+    def draw_sprite(self, x, y, sprite, sprite_width=8):
+        """XORs the sprite onto the screen at (x, y), wrapping around the edges. Sprites are 8 pixels wide with a byte
+        per row, or 16 pixels wide with two bytes per row. Returns the collision flag and the rows which were drawn
+        to. """
+        width = self.width
+        height = self.height
+        row_bytes = self.row_bytes
+        buffer = self.buffer
+        x %= width
+        y %= height
+        sprite_bytes = sprite_width // 8
+        lines = len(sprite) // sprite_bytes
+        size = lines * row_bytes
+        # Lay the sprite out at the left edge of blank rows, then rotate every row into position at once. The bits
+        # each row loses on the right are the ones which wrap around to its left.
+        block = bytearray(size)
+        for i in range(sprite_bytes):
+            block[i::row_bytes] = sprite[i:lines * sprite_bytes:sprite_bytes]
+        bits = int.from_bytes(block, 'big')
+        if x:
+            keep = int.from_bytes((self.row_mask >> x).to_bytes(row_bytes, 'big') * lines, 'big')
+            bits = bits >> x & keep | bits << (width - x) & ~keep & ((1 << size * 8) - 1)
+        start = y * row_bytes
+        if y + lines <= height:
+            rows = range(y, y + lines)
+            screen = buffer[start:start + size]
+        else:
+            # The sprite wraps around to the top of the screen
+            rows = [(y + j) % height for j in range(lines)]
+            screen = buffer[start:] + buffer[:size - (len(buffer) - start)]
+        if not bits:
+            return 0, rows
+        word = int.from_bytes(screen, 'big')
+        screen = (word ^ bits).to_bytes(size, 'big')
+        if y + lines <= height:
+            buffer[start:start + size] = screen
+        else:
+            buffer[start:] = screen[:len(buffer) - start]
+            buffer[:size - (len(buffer) - start)] = screen[len(buffer) - start:]
+        self.damaged = True
+        return 1 if word & bits else 0, rows
+
+    def scroll_down(self, lines):
+        """Moves the screen down, blank rows come in at the top. Rows are contiguous, so it's one slice move."""
+        shift = min(lines, self.height) * self.row_bytes
+        if shift:
+            self.buffer[shift:] = self.buffer[:len(self.buffer) - shift]
+            self.buffer[:shift] = bytes(shift)
+            self.damaged = True
+
+    def scroll_up(self, lines):
+        shift = min(lines, self.height) * self.row_bytes
+        if shift:
+            self.buffer[:len(self.buffer) - shift] = self.buffer[shift:]
+            self.buffer[len(self.buffer) - shift:] = bytes(shift)
+            self.damaged = True
+
+    def scroll_right(self, pixels):
+        """Moves every row right, blank pixels come in on the left. The whole screen is shifted as a single integer
+        and the bits which crossed into the next row are masked off."""
+        keep = self.row_mask >> pixels
+        self.shift_screen(-pixels, keep)
+
+    def scroll_left(self, pixels):
+        keep = self.row_mask << pixels & self.row_mask
+        self.shift_screen(pixels, keep)
+
+    def shift_screen(self, bits, keep):
+        """Shifts the whole screen left by bits (right when negative) and keeps the bits of keep in every row"""
+        screen = int.from_bytes(self.buffer, 'big')
+        screen = screen << bits if bits >= 0 else screen >> -bits
+        mask = int.from_bytes(keep.to_bytes(self.row_bytes, 'big') * self.height, 'big')
+        self.buffer[:] = (screen & mask).to_bytes(len(self.buffer), 'big')
+        self.damaged = True
+
+    def hash(self):
+        """SHA-1 of the packed framebuffer"""
+        return hashlib.sha1(self.buffer).hexdigest()
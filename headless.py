@@ -0,0 +1,208 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import sys
+import time
+from interpreter import Interpreter
+
+
+class NullDisplay:
+    def __init__(self):
+        """Display which doesn't draw anything, the framebuffer is only kept by the interpreter"""
+
+        # Chip-8 display
+        self.width = 64
+        self.height = 32
+
+    def update_rows(self, framebuffer, rows):
+        return
+
+    def clear_screen(self):
+        return
+
+    def render(self):
+        return
+
+    def destroy(self):
+        return
+
+
+class ScriptedKeypad:
+    def __init__(self, events=()):
+        """Keypad driven by a list of (instruction count, hex key, pressed) events"""
+        self.events = sorted(events, key=lambda event: event[0])
+        self.next_event = 0
+
+        # Current hex key that is down
+        self.key = 0
+        self.keydown = False
+
+    def poll(self, instruction_count):
+        """Applies every event scheduled at or before the given instruction count"""
+        while self.next_event < len(self.events) and self.events[self.next_event][0] <= instruction_count:
+            _, key, pressed = self.events[self.next_event]
+            self.key = key
+            self.keydown = pressed
+            self.next_event += 1
+
+    def finished(self):
+        return self.next_event >= len(self.events)
+
+
+class SilentAudio:
+    def set_tone(self, on):
+        return
+
+    def close(self):
+        return
+
+
+# Execution engines selectable from the command line
+engines = ['interpreter', 'recompiler']
+
+
+def create_interpreter(keypad=None, engine='interpreter', seed=None, display=None):
+    """Creates an interpreter wired to the headless backends"""
+    errors = []
+    interpreter = Interpreter(display or NullDisplay(), keypad or ScriptedKeypad(), SilentAudio(), debug=False,
+                              error_handler=lambda title, message: errors.append(title + ": " + message), seed=seed)
+    interpreter.errors = errors
+    if engine == 'recompiler':
+        # Optional parts are only imported when asked for, so a plain run starts quickly
+        from recompiler import Recompiler
+        Recompiler(interpreter).attach()
+    return interpreter
+
+
+def run(interpreter, instructions=None, frames=None):
+    """Runs until the instruction or frame budget is spent, returns the elapsed time in seconds"""
+    start = time.perf_counter()
+    if frames is not None:
+        for i in range(frames):
+            interpreter.run_frame()
+            if interpreter.error:
+                break
+    else:
+        while interpreter.instruction_count < instructions and not interpreter.error:
+            interpreter.run_frame()
+            # Nothing can release an Fx0A once the key script has run out
+            if interpreter.wait_for_key and not interpreter.keyboard.keydown and interpreter.keyboard.finished():
+                break
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m headless', description='Run a Chip-8 ROM without a window')
+    parser.add_argument('rom', help='path to the ROM file')
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument('-i', '--instructions', type=int, help='number of instructions to execute')
+    budget.add_argument('-f', '--frames', type=int, help='number of frames to execute')
+    budget.add_argument('-r', '--replay', metavar='MOVIE', help='play back a movie recorded with this ROM')
+    parser.add_argument('-c', '--clock-rate', type=int,
+                        help="instructions per second of emulated time (default: the library's preferred rate or 600)")
+    parser.add_argument('-e', '--engine', choices=engines, default='interpreter', help='execution engine to use')
+    parser.add_argument('-p', '--profile', metavar='JSON', help='profile the interpreter and write the results')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed for the Cxkk random number generator')
+    parser.add_argument('-l', '--library', metavar='DIRECTORY',
+                        help='open the ROM through a ROM library, reusing and extending its saved analysis')
+    args = parser.parse_args(argv)
+    if args.instructions is None and args.frames is None:
+        args.frames = 600
+    if args.profile is not None and args.engine != 'interpreter':
+        parser.error('profiling replaces the execution engine, use --engine interpreter')
+
+    player = None
+    if args.replay is not None:
+        import movie
+        try:
+            with open(args.replay, 'rb') as file:
+                player = movie.MoviePlayer(movie.decode(file.read()))
+        except (IOError, movie.MovieError) as error:
+            print("Couldn't open movie: " + str(error), file=sys.stderr)
+            return 1
+
+    interpreter = create_interpreter(player, args.engine, args.seed)
+    interpreter.clock_rate = args.clock_rate or 600
+    profiler = None
+    if args.profile is not None:
+        from profiler import Profiler
+        profiler = Profiler(interpreter)
+        profiler.attach()
+    library = None
+    try:
+        if args.library is not None:
+            from rom_library import RomLibrary
+            library = RomLibrary(args.library)
+            library.open(interpreter, args.rom)
+            # The library's preferred clock rate only applies when none was asked for
+            if args.clock_rate is not None:
+                interpreter.clock_rate = args.clock_rate
+        else:
+            with open(args.rom, 'rb') as file:
+                interpreter.load_program_to_memory(file)
+    except IOError as error:
+        print("Couldn't open file: " + str(error), file=sys.stderr)
+        return 1
+
+    elapsed = 0.0
+    matches = True
+    if player is not None and not interpreter.error:
+        try:
+            player.start(interpreter)
+        except movie.MovieError as error:
+            print(str(error), file=sys.stderr)
+            return 1
+        start = time.perf_counter()
+        matches = player.play(interpreter)
+        elapsed = time.perf_counter() - start
+    elif not interpreter.error:
+        elapsed = run(interpreter, args.instructions, args.frames)
+
+    if library is not None:
+        library.save_analysis(interpreter)
+
+    for error in interpreter.errors:
+        print(error, file=sys.stderr)
+    # Skipped idle loops take no time, the speed only counts instructions which actually ran
+    executed = interpreter.instruction_count - interpreter.idle_cycles
+    speed = executed / elapsed if elapsed > 0 else 0.0
+    print("Instructions: " + str(interpreter.instruction_count))
+    print("Instructions executed: " + str(executed))
+    print("Idle instructions skipped: " + str(interpreter.idle_cycles))
+    print("Seconds: %.3f" % elapsed)
+    print("Instructions/second: %.0f" % speed)
+    if args.engine == 'interpreter':
+        print("Decode cache hit rate: %.4f" % interpreter.decode_cache_hit_rate())
+    print("Framebuffer hash: " + interpreter.framebuffer.hash())
+    if profiler is not None:
+        profiler.export(args.profile)
+        print("Profile: " + profiler.overlay(len(profiler.frame_times)))
+    if player is not None:
+        print("Replay: " + ("matches the recording" if matches else "differs from the recording"))
+    return 1 if interpreter.error or not matches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
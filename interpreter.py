@@ -22,34 +22,72 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import numpy as np
-from tkinter import messagebox
+import hashlib
 import random
+from framebuffer import Framebuffer, LOW_RESOLUTION, HIGH_RESOLUTION
+
+
+def show_error(title, message):
+    """Shows an error dialog, tkinter is only imported when an error actually occurs"""
+    from tkinter import messagebox
+    messagebox.showerror(title, message)
 
 
 # noinspection PyPep8Naming
 class Interpreter:
-    def __init__(self, display, keyboard, audio):
-        """Chip-8 interpreter"""
-
-        # Number of instructions to execute per render call
-        self.num_cycles = 10
+    # Shared (handler, x, y, n, address, byte) entries for every opcode word, each one is built the first time any
+    # interpreter decodes that opcode
+    dispatch_table = [None] * 0x10000
+
+    # Hex digit sprites, copied to the start of memory on every reset
+    sprites = bytes([0xF0, 0x90, 0x90, 0x90, 0xF0,  # 0
+                     0x20, 0x60, 0x20, 0x20, 0x70,  # 1
+                     0xF0, 0x10, 0xF0, 0x80, 0xF0,  # 2
+                     0xF0, 0x10, 0xF0, 0x10, 0xF0,  # 3
+                     0x90, 0x90, 0xF0, 0x10, 0x10,  # 4
+                     0xF0, 0x80, 0xF0, 0x10, 0xF0,  # 5
+                     0xF0, 0x80, 0xF0, 0x90, 0xF0,  # 6
+                     0xF0, 0x10, 0x20, 0x40, 0x40,  # 7
+                     0xF0, 0x90, 0xF0, 0x90, 0xF0,  # 8
+                     0xF0, 0x90, 0xF0, 0x10, 0xF0,  # 9
+                     0xF0, 0x90, 0xF0, 0x90, 0x90,  # A
+                     0xE0, 0x90, 0xE0, 0x90, 0xE0,  # B
+                     0xF0, 0x80, 0x80, 0x80, 0xF0,  # C
+                     0xE0, 0x90, 0x90, 0x90, 0xE0,  # D
+                     0xF0, 0x80, 0xF0, 0x80, 0xF0,  # E
+                     0xF0, 0x80, 0xF0, 0x80, 0x80   # F
+                     ])
+    # SUPER-CHIP's 8x10 digits selected by Fx30, XO-CHIP adds A to F
+    large_sprites = bytes([0x3C, 0x7E, 0xE7, 0xC3, 0xC3, 0xC3, 0xC3, 0xE7, 0x7E, 0x3C,  # 0
+                           0x18, 0x38, 0x58, 0x18, 0x18, 0x18, 0x18, 0x18, 0x18, 0x3C,  # 1
+                           0x3E, 0x7F, 0xC3, 0x06, 0x0C, 0x18, 0x30, 0x60, 0xFF, 0xFF,  # 2
+                           0x3C, 0x7E, 0xC3, 0x03, 0x0E, 0x0E, 0x03, 0xC3, 0x7E, 0x3C,  # 3
+                           0x06, 0x0E, 0x1E, 0x36, 0x66, 0xC6, 0xFF, 0xFF, 0x06, 0x06,  # 4
+                           0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFE, 0x03, 0xC3, 0x7E, 0x3C,  # 5
+                           0x3E, 0x7C, 0xE0, 0xC0, 0xFC, 0xFE, 0xC3, 0xC3, 0x7E, 0x3C,  # 6
+                           0xFF, 0xFF, 0x03, 0x06, 0x0C, 0x18, 0x30, 0x60, 0x60, 0x60,  # 7
+                           0x3C, 0x7E, 0xC3, 0xC3, 0x7E, 0x7E, 0xC3, 0xC3, 0x7E, 0x3C,  # 8
+                           0x3C, 0x7E, 0xC3, 0xC3, 0x7F, 0x3F, 0x03, 0x03, 0x3E, 0x7C,  # 9
+                           0x3C, 0x7E, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3, 0xC3,  # A
+                           0xFC, 0xFE, 0xC3, 0xC3, 0xFE, 0xFE, 0xC3, 0xC3, 0xFE, 0xFC,  # B
+                           0x3C, 0x7E, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0x7E, 0x3C,  # C
+                           0xFC, 0xFE, 0xC7, 0xC3, 0xC3, 0xC3, 0xC3, 0xC7, 0xFE, 0xFC,  # D
+                           0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFC, 0xC0, 0xC0, 0xFF, 0xFF,  # E
+                           0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFC, 0xC0, 0xC0, 0xC0, 0xC0   # F
+                           ])
+    # Both fonts, the large digits follow the small ones
+    font = sprites + large_sprites
+
+    # Chip-8 and SUPER-CHIP programs see 4 KB of memory, XO-CHIP programs 64 KB
+    memory_size = 0x1000
+    extended_memory_size = 0x10000
+
+    def __init__(self, display, keyboard, audio, debug=False, error_handler=show_error, seed=None):
+        """Chip-8 interpreter, a seed makes Cxkk produce the same numbers every time a ROM is loaded"""
+
+        # Emulated CPU speed in instructions per second, the timers always run at 60 Hz
+        self.clock_rate = 600
 
-        # Interpreter can access 4KB of RAM
-        self.memory_buffer = np.array([0] * 4096, np.ubyte)
-        # 16 general purpose 8-bit registers
-        self.register_v = np.array([0] * 16, np.ubyte)
-        # 16-bit register for memory addresses
-        self.register_i = np.int16(0)
-        # 8-bit registers for delay/sound timers
-        self.register_d = np.ubyte(0)
-        self.register_s = np.ubyte(0)
-        # 16-bit program counter register which stores current address
-        self.program_counter = 0x200
-        # 8-bit pointer to top of stack
-        self.stack_pointer = np.ubyte(0)
-        # 16 16-bit addresses which represent the call stack
-        self.stack = np.array([0] * 16, np.uint16)
         # Reference to external display
         self.display = display
         # Reference to keymap
@@ -57,157 +95,319 @@ class Interpreter:
         # Reference to audio synthesizer
         self.audio = audio
 
+        # Error handling
+        self.error_handler = error_handler
+
+        # Debug mode
+        self.debug = debug
+
+        # Busy waits on the delay timer or the keypad are fast-forwarded instead of executed one by one
+        self.skip_idle_loops = True
+
+        # Seed for the random number generator used by Cxkk, it's reseeded on every reset
+        self.seed = seed
+
+        self.reset()
+
+    def reset(self):
+        """Puts the machine back into its power-on state, with the font in memory and nothing else loaded"""
+        # Instructions owed to (or overrun from) previous frames, keeps fractional and overshooting budgets exact
+        self.cycle_balance = 0.0
+
+        # Machine state is kept in native ints and bytearrays, results are masked to the register size
+        # Interpreter can access 4KB of RAM, grown to 64KB for XO-CHIP programs
+        self.memory_buffer = bytearray(self.memory_size)
+        # 16 general purpose 8-bit registers
+        self.register_v = bytearray(16)
+        # 16-bit register for memory addresses
+        self.register_i = 0
+        # 8-bit registers for delay/sound timers
+        self.register_d = 0
+        self.register_s = 0
+        # 12-bit program counter register which stores current address
+        self.program_counter = 0x200
+        # Number of addresses on the stack, the next call stores its return address at this index
+        self.stack_pointer = 0
+        # 16 12-bit addresses which represent the call stack
+        self.stack = [0] * 16
+        # SUPER-CHIP/XO-CHIP flag registers, V registers are saved to them by Fx75 and loaded by Fx85
+        self.flags = bytearray(16)
+        # Screen contents, the display is told which rows changed. The high resolution mode replaces it with one
+        # twice the size. The display follows the framebuffer's size, so it's never asked for one.
+        self.framebuffer = Framebuffer(*LOW_RESOLUTION)
+
         # Used for Fx0A
         self.wait_for_key = False
         self.x = 0
 
-        # Error handling
         self.error = False
 
-        # Debug mode
-        self.debug = True
+        # Random number generator used by Cxkk, each interpreter has its own so its state can be saved
+        self.random = random.Random(self.seed)
 
-        # Using a dictionary to look up which function to use for any opcode
-        # https://en.wikipedia.org/wiki/CHIP-8
-        # Most of the descriptions are taken directly from http://devernay.free.fr/hacks/chip8/C8TECH10.HTM#3.1
-        # Using 'F' as a placeholder for N, X, and Y
-        self.opcode = {}
-
-        self.initialized_hash = False
-
-        self.opcode[self.hash_opcode(0x00, 0x00)] = self._0NNN
-        self.opcode[self.hash_opcode(0x00, 0xE0)] = self._00E0
-        self.opcode[self.hash_opcode(0x00, 0xEE)] = self._00EE
-        self.opcode[self.hash_opcode(0x1F, 0xFF)] = self._1nnn
-        self.opcode[self.hash_opcode(0x2F, 0xFF)] = self._2nnn
-        self.opcode[self.hash_opcode(0x3F, 0xFF)] = self._3xkk
-        self.opcode[self.hash_opcode(0x4F, 0xFF)] = self._4xkk
-        self.opcode[self.hash_opcode(0x5F, 0xF0)] = self._5xy0
-        self.opcode[self.hash_opcode(0x6F, 0xFF)] = self._6xkk
-        self.opcode[self.hash_opcode(0x7F, 0xFF)] = self._7xkk
-        self.opcode[self.hash_opcode(0x8F, 0xF0)] = self._8xy0
-        self.opcode[self.hash_opcode(0x8F, 0xF1)] = self._8xy1
-        self.opcode[self.hash_opcode(0x8F, 0xF2)] = self._8xy2
-        self.opcode[self.hash_opcode(0x8F, 0xF3)] = self._8xy3
-        self.opcode[self.hash_opcode(0x8F, 0xF4)] = self._8xy4
-        self.opcode[self.hash_opcode(0x8F, 0xF5)] = self._8xy5
-        self.opcode[self.hash_opcode(0x8F, 0xF6)] = self._8xy6
-        self.opcode[self.hash_opcode(0x8F, 0xF7)] = self._8xy7
-        self.opcode[self.hash_opcode(0x8F, 0xFE)] = self._8xyE
-        self.opcode[self.hash_opcode(0x9F, 0xF0)] = self._9xy0
-        self.opcode[self.hash_opcode(0xAF, 0xFF)] = self._Annn
-        self.opcode[self.hash_opcode(0xBF, 0xFF)] = self._Bnnn
-        self.opcode[self.hash_opcode(0xCF, 0xFF)] = self._Cxkk
-        self.opcode[self.hash_opcode(0xDF, 0xFF)] = self._Dxyn
-        self.opcode[self.hash_opcode(0xEF, 0x9E)] = self._Ex9E
-        self.opcode[self.hash_opcode(0xEF, 0xA1)] = self._ExA1
-        self.opcode[self.hash_opcode(0xFF, 0x07)] = self._Fx07
-        self.opcode[self.hash_opcode(0xFF, 0x0A)] = self._Fx0A
-        self.opcode[self.hash_opcode(0xFF, 0x15)] = self._Fx15
-        self.opcode[self.hash_opcode(0xFF, 0x18)] = self._Fx18
-        self.opcode[self.hash_opcode(0xFF, 0x1E)] = self._Fx1E
-        self.opcode[self.hash_opcode(0xFF, 0x29)] = self._Fx29
-        self.opcode[self.hash_opcode(0xFF, 0x33)] = self._Fx33
-        self.opcode[self.hash_opcode(0xFF, 0x55)] = self._Fx55
-        self.opcode[self.hash_opcode(0xFF, 0x65)] = self._Fx65
-
-        self.initialized_hash = True
-
-        # Hex Sprites
-
-        # "0"
-        self.sprites = [0xF0, 0x90, 0x90, 0x90, 0xF0,  # 0
-                        0x20, 0x60, 0x20, 0x20, 0x70,  # 1
-                        0xF0, 0x10, 0xF0, 0x80, 0xF0,  # 2
-                        0xF0, 0x10, 0xF0, 0x10, 0xF0,  # 3
-                        0x90, 0x90, 0xF0, 0x10, 0x10,  # 4
-                        0xF0, 0x80, 0xF0, 0x10, 0xF0,  # 5
-                        0xF0, 0x80, 0xF0, 0x90, 0xF0,  # 6
-                        0xF0, 0x10, 0x20, 0x40, 0x40,  # 7
-                        0xF0, 0x90, 0xF0, 0x90, 0xF0,  # 8
-                        0xF0, 0x90, 0xF0, 0x10, 0xF0,  # 9
-                        0xF0, 0x90, 0xF0, 0x90, 0x90,  # A
-                        0xE0, 0x90, 0xE0, 0x90, 0xE0,  # B
-                        0xF0, 0x80, 0x80, 0x80, 0xF0,  # C
-                        0xE0, 0x90, 0x90, 0x90, 0xE0,  # D
-                        0xF0, 0x80, 0xF0, 0x80, 0xF0,  # E
-                        0xF0, 0x80, 0xF0, 0x80, 0x80   # F
-                        ]
-
-        for i in range(len(self.sprites)):
-            self.memory_buffer[i] = self.sprites[i]
-
-        if self.debug:
-            assert(len(self.opcode) == 35)
+        # SHA-1 of the loaded ROM, save states are only restored onto the same ROM
+        self.rom_hash = bytes(20)
+
+        # Total number of instructions executed since the program was loaded
+        self.instruction_count = 0
+        # Number of 60 Hz timer ticks since the program was loaded
+        self.frame_count = 0
+
+        # Dispatch table entry for the instruction at each address, filled on first execution
+        self.decode_cache = [None] * len(self.memory_buffer)
+        # Number of instructions which had to be decoded from memory
+        self.decode_misses = 0
+
+        # Length in instructions of the idle loop the last jump closed, 0 if it wasn't one
+        self.idle_loop = 0
+        # Whether the last call to execute_cycles ended waiting in an idle loop
+        self.idle = False
+        # Instructions accounted for without being executed
+        self.idle_cycles = 0
+
+        self.memory_buffer[:len(self.font)] = self.font
 
     def load_program_to_memory(self, file):
         """Stores the program in the memory buffer"""
-        file_bin = bytes(file.read())
-        program = file_bin.hex()
-        self.__init__(self.display, self.keyboard, self.audio)
+        program = file.read()
+        self.reset()
+        self.rom_hash = hashlib.sha1(program).digest()
         self.display.clear_screen()
         # Make sure program isn't too large
-        if int(len(program) / 2 > (4096 - 0x200)):
-            messagebox.showerror("ROM Error", "ROM size is too large!")
+        if len(program) > self.extended_memory_size - 0x200:
+            self.error_handler("ROM Error", "ROM size is too large!")
             self.error = True
             return
-        # Store each individual opcode in 2 bytes of RAM starting at 0x200
-        for i in range(int(len(program) / 4)):
-            opcode = program[i*4:i*4+4]
-            # Need to split opcode in half to fit in a byte
-            self.memory_buffer[self.program_counter + i*2] = (int(opcode[:2], 16))
-            self.memory_buffer[self.program_counter + (i*2)+1] = (int(opcode[2:], 16))
-        # Successfully loaded ROM
-        self.error = False
+        if len(program) > len(self.memory_buffer) - 0x200:
+            self.extend_memory()
+        # Programs start at 0x200, the whole file is copied in one go
+        self.memory_buffer[0x200:0x200 + len(program)] = program
+        self.invalidate_memory(0x200, len(program))
+
+    def run_frame(self, limit=None):
+        """Executes one 60 Hz frame of emulated time, clock_rate / 60 instructions followed by a timer tick. With a
+        limit at most that many instructions run, and any beyond it are dropped rather than owed. """
+        self.cycle_balance += self.clock_rate / 60
+        cycles = max(0, int(self.cycle_balance))
+        if limit is not None and cycles > limit:
+            self.cycle_balance -= cycles - limit
+            cycles = limit
+        # Called even when no instruction is due, so the keypad is polled once every frame
+        self.cycle_balance -= self.run_cycles(cycles)
+        if self.wait_for_key or self.error:
+            # Time spent waiting isn't owed to the program afterwards
+            self.cycle_balance = 0.0
+        self.tick_timers()
+
+    def run_cycles(self, cycles):
+        """Executes up to the given number of instructions, resuming from Fx0A once a key is down. Returns the
+        number of instructions which were executed. """
+        # Let scripted input sources catch up to the current instruction
+        self.keyboard.poll(self.instruction_count)
+        # Execution stays stopped after an error
+        if self.error:
+            return 0
+        # Check if executing Fx0A
+        if self.wait_for_key:
+            if not self.keyboard.keydown:
+                return 0
+            # Continue execution from opcode Fx0A
+            self.wait_for_key = False
+            self.register_v[self.x] = self.keyboard.key
+            self.program_counter += 2
+        return self.execute_cycles(cycles)
 
-    def execute_instruction(self):
-        """Executes the current instruction in the program counter register"""
-        # Update the timer registers at ~60hz
+    def tick_timers(self):
+        """Decrements the delay and sound timers, called at 60 Hz of emulated time"""
+        self.frame_count += 1
         if self.register_d > 0:
-            self.register_d -= int(self.display.max_fps / 60)
-            if self.register_d < 0:
-                self.register_d = 0
+            self.register_d -= 1
         if self.register_s > 0:
-            self.register_s -= int(self.display.max_fps / 60)
-            if self.register_s < 0:
-                self.register_s = 0
-        upper_byte = self.memory_buffer[self.program_counter]
-        lower_byte = self.memory_buffer[self.program_counter + 1]
-        x = upper_byte & 0b1111
-        y = lower_byte >> 4 & 0b1111
-        n = lower_byte & 0b1111
-        address = x << 8 | lower_byte
-        if self.debug:
-            print("Current Opcode: ")
-        hash_value = self.hash_opcode(upper_byte, lower_byte)
-        if hash_value not in self.opcode:
-            messagebox.showerror("ROM Error", "Couldn't read ROM...")
-            self.error = True
+            self.register_s -= 1
+            if self.register_s == 0:
+                self.audio.set_tone(False)
+
+    def execute_cycles(self, cycles):
+        """Executes up to the given number of instructions, stopping early on errors and Fx0A. Returns the number
+        of instructions which were executed. """
+        start = self.instruction_count
+        self.idle = False
+        for i in range(cycles):
+            self.execute_instruction()
+            if self.error or self.wait_for_key or self.idle_loop:
+                break
+        if self.idle_loop:
+            # Nothing can change until the budget runs out, whole iterations are skipped and the rest executed
+            self.instruction_count += self.skip_idle_loop(start + cycles - self.instruction_count)
+            for i in range(start + cycles - self.instruction_count):
+                self.execute_instruction()
+        return self.instruction_count - start
+
+    def execute_instruction(self):
+        """Executes the current instruction in the program counter register"""
+        try:
+            entry = self.decode_cache[self.program_counter]
+        except IndexError:
+            # Past the end of memory, decoding reports it
+            entry = None
+        if entry is None:
+            entry = self.decode_instruction(self.program_counter)
+        handler, x, y, n, address, byte = entry
+        handler(self, x, y, n, address, byte)
+        self.instruction_count += 1
+
+    def check_idle_loop(self, head, jump):
+        """Called by jumps one or two instructions backwards. Sets idle_loop to the loop's length if it can only exit
+        after a timer tick or a keypad change, which don't happen in the middle of execute_cycles. """
+        if not self.skip_idle_loops:
             return
-        self.opcode[hash_value](x, y, n, address, lower_byte)
-
-    def hash_opcode(self, upper_byte, lower_byte):
-        """Gets an ID for a 2-byte opcode using the first and last 4-8 bits"""
-        upper_bits = upper_byte >> 4 & 0b1111
-        lower_bits = lower_byte & 0b1111
-
-        if upper_bits == 0xF or upper_bits == 0xE:
-            # Encode opcodes beginning with F or E
-            hash_value = upper_bits << 8 | lower_byte
-        elif upper_bits == 0x0:
-            hash_value = lower_byte
-            if self.initialized_hash and hash_value not in self.opcode:
-                # 'Call' opcode
-                hash_value = 0x00
-        elif upper_bits == 0x08:
-            hash_value = upper_bits << 8 | lower_bits
+        memory = self.memory_buffer
+        first = memory[head] << 8 | memory[head + 1]
+        x = first >> 8 & 0xF
+        if jump - head == 2:
+            # Ex9E or ExA1 jumping back to itself, waiting for a key to go down or up
+            pressed = self.keyboard.keydown and self.keyboard.key == self.register_v[x]
+            if first & 0xF0FF == 0xE09E and not pressed or first & 0xF0FF == 0xE0A1 and pressed:
+                self.idle_loop = 2
+        elif first & 0xF0FF == 0xF007:
+            # Fx07 and a 3xkk/4xkk on the same register, waiting for the delay timer to reach (or leave) kk
+            second = memory[head + 2] << 8 | memory[head + 3]
+            if second >> 8 in (0x30 | x, 0x40 | x) and (self.register_d == second & 0xFF) != (second >> 12 == 3):
+                self.idle_loop = 3
+
+    def skip_idle_loop(self, cycles):
+        """Accounts for the whole iterations of the detected idle loop which fit in the given number of instructions,
+        the program counter is at the head of the loop. Returns the number of instructions skipped. """
+        length = self.idle_loop
+        self.idle_loop = 0
+        self.idle = True
+        skipped = max(0, cycles) // length * length
+        if skipped and length == 3:
+            # The only thing the timer loop changes is the register Fx07 writes
+            self.register_v[self.memory_buffer[self.program_counter] & 0xF] = self.register_d
+        self.idle_cycles += skipped
+        return skipped
+
+    def extend_memory(self):
+        """Grows memory to XO-CHIP's 64 KB. The buffer is extended in place, so code holding on to it keeps working."""
+        added = self.extended_memory_size - len(self.memory_buffer)
+        self.memory_buffer.extend(bytes(added))
+        self.decode_cache.extend([None] * added)
+
+    def set_resolution(self, width, height):
+        """Switches to a blank screen of the given size"""
+        if self.framebuffer.width == width and self.framebuffer.height == height:
+            self.framebuffer.clear()
         else:
-            hash_value = upper_bits
+            self.framebuffer = Framebuffer(width, height)
+        self.display.clear_screen()
 
-        if self.debug:
-            print(hex(upper_byte) + hex(lower_byte)[2:] + ": " + str(hash_value))
+    def skip_instruction(self):
+        """Moves past the next instruction, XO-CHIP's four byte F000 nnnn is skipped as a whole"""
+        address = self.program_counter + 2
+        if self.memory_buffer[address:address + 2] == b'\xF0\x00':
+            self.program_counter += 6
+        else:
+            self.program_counter += 4
 
-        return hash_value
+    def decode_instruction(self, address):
+        """Looks up the instruction at the address and stores it in the decode cache"""
+        if address + 1 >= len(self.memory_buffer):
+            # There's no instruction to cache, the entry stops execution
+            return type(self)._program_counter_out_of_range, 0, 0, 0, 0, 0
+        opcode = self.memory_buffer[address] << 8 | self.memory_buffer[address + 1]
+        entry = self.dispatch(opcode)
+        self.decode_cache[address] = entry
+        self.decode_misses += 1
+        return entry
+
+    def invalidate_memory(self, address, length):
+        """Drops cached instructions overlapping the bytes which were written"""
+        # An instruction starting one byte before the write also reads the first written byte
+        for i in range(max(address - 1, 0), min(address + length, len(self.decode_cache))):
+            self.decode_cache[i] = None
+
+    def decode_cache_hit_rate(self):
+        """Fraction of executed instructions which were served by the decode cache, skipped idle loops don't count"""
+        executed = self.instruction_count - self.idle_cycles
+        if executed <= 0:
+            return 0.0
+        return 1.0 - self.decode_misses / executed
+
+    @classmethod
+    def dispatch(cls, opcode):
+        """Gets the (handler, x, y, n, address, byte) entry for a 16-bit opcode from the shared dispatch table"""
+        entry = cls.dispatch_table[opcode]
+        if entry is None:
+            entry = (getattr(cls, cls.decode_opcode(opcode)), opcode >> 8 & 0xF, opcode >> 4 & 0xF, opcode & 0xF,
+                     opcode & 0xFFF, opcode & 0xFF)
+            cls.dispatch_table[opcode] = entry
+        return entry
+
+    # Handlers selected by the lower nibble/byte of opcodes beginning with 8, E and F
+    alu_opcodes = {0x0: '_8xy0', 0x1: '_8xy1', 0x2: '_8xy2', 0x3: '_8xy3', 0x4: '_8xy4', 0x5: '_8xy5',
+                   0x6: '_8xy6', 0x7: '_8xy7', 0xE: '_8xyE'}
+    key_opcodes = {0x9E: '_Ex9E', 0xA1: '_ExA1'}
+    misc_opcodes = {0x07: '_Fx07', 0x0A: '_Fx0A', 0x15: '_Fx15', 0x18: '_Fx18', 0x1E: '_Fx1E', 0x29: '_Fx29',
+                    0x30: '_Fx30', 0x33: '_Fx33', 0x55: '_Fx55', 0x65: '_Fx65', 0x75: '_Fx75', 0x85: '_Fx85'}
+    # XO-CHIP register range opcodes, every other 5xyn compares registers like 5xy0
+    register_opcodes = {0x2: '_5xy2', 0x3: '_5xy3'}
+    # SUPER-CHIP and XO-CHIP opcodes beginning with 00
+    screen_opcodes = {0xFB: '_00FB', 0xFC: '_00FC', 0xFD: '_00FD', 0xFE: '_00FE', 0xFF: '_00FF'}
+
+    @classmethod
+    def decode_opcode(cls, opcode):
+        """Gets the name of the handler for a 2-byte opcode using the first and last 4-8 bits"""
+        # https://en.wikipedia.org/wiki/CHIP-8
+        # Most of the descriptions are taken directly from http://devernay.free.fr/hacks/chip8/C8TECH10.HTM#3.1
+        upper_bits = opcode >> 12
+        if upper_bits == 0x0:
+            if opcode == 0x00E0:
+                return '_00E0'
+            if opcode == 0x00EE:
+                return '_00EE'
+            if opcode & 0xFFF0 == 0x00C0:
+                return '_00Cn'
+            if opcode & 0xFFF0 == 0x00D0:
+                return '_00Dn'
+            if opcode in cls.screen_opcodes:
+                return cls.screen_opcodes[opcode]
+            # 'Call' opcode
+            return '_0NNN'
+        if upper_bits == 0x5:
+            return cls.register_opcodes.get(opcode & 0xF, '_5xy0')
+        if upper_bits == 0x8:
+            return cls.alu_opcodes.get(opcode & 0xF, '_unknown_opcode')
+        if upper_bits == 0xE:
+            return cls.key_opcodes.get(opcode & 0xFF, '_unknown_opcode')
+        if upper_bits == 0xD and opcode & 0xF == 0:
+            return '_Dxy0'
+        if upper_bits == 0xF:
+            if opcode == 0xF000:
+                return '_F000'
+            return cls.misc_opcodes.get(opcode & 0xFF, '_unknown_opcode')
+        return ('_0NNN', '_1nnn', '_2nnn', '_3xkk', '_4xkk', '_5xy0', '_6xkk', '_7xkk',
+                '_8xy0', '_9xy0', '_Annn', '_Bnnn', '_Cxkk', '_Dxyn')[upper_bits]
+
+    def _unknown_opcode(self, x, y, n, address, byte):
+        """Any opcode which isn't part of the instruction set stops execution."""
+        self.error_handler("ROM Error", "Couldn't read ROM...")
+        self.error = True
+
+    def _memory_out_of_range(self):
+        """Slice copies past the end of memory would resize the bytearray, so stop execution instead."""
+        self.error_handler("ROM Error", "Memory access out of range")
+        self.error = True
+
+    def _program_counter_out_of_range(self, x, y, n, address, byte):
+        """Runaway programs reaching the end of memory stop execution rather than reading past it."""
+        self.error_handler("ROM Error", "Program counter out of range")
+        self.error = True
+
+    def _stack_out_of_range(self):
+        """Calls nested more than 16 deep or returns with nothing left to unwind stop execution."""
+        self.error_handler("ROM Error", "Stack pointer out of range")
+        self.error = True
 
     def _0NNN(self, x, y, n, address, byte):
         """Jump to a machine code routine at nnn. This instruction is only used on the old computers on which Chip-8
@@ -216,31 +416,78 @@ class Interpreter:
 
     def _00E0(self, x, y, n, address, byte):
         """Clear the display."""
+        self.framebuffer.clear()
         self.display.clear_screen()
         self.program_counter += 2
 
     def _00EE(self, x, y, n, address, byte):
-        """Return from a subroutine. The interpreter sets the program counter to the address at the top of the stack,
-        then subtracts 1 from the stack pointer. """
-        self.program_counter = self.stack[self.stack_pointer] + 2
+        """Return from a subroutine. The interpreter subtracts 1 from the stack pointer, then sets the program counter
+        to the address at the top of the stack. """
+        if self.stack_pointer == 0:
+            self._stack_out_of_range()
+            return
         self.stack_pointer -= 1
+        self.program_counter = self.stack[self.stack_pointer] + 2
+
+    def _00Cn(self, x, y, n, address, byte):
+        """Scroll the display down n lines. SUPER-CHIP."""
+        self.framebuffer.scroll_down(n)
+        self.display.update_rows(self.framebuffer, range(self.framebuffer.height))
+        self.program_counter += 2
+
+    def _00Dn(self, x, y, n, address, byte):
+        """Scroll the display up n lines. XO-CHIP."""
+        self.framebuffer.scroll_up(n)
+        self.display.update_rows(self.framebuffer, range(self.framebuffer.height))
+        self.program_counter += 2
+
+    def _00FB(self, x, y, n, address, byte):
+        """Scroll the display right 4 pixels. SUPER-CHIP."""
+        self.framebuffer.scroll_right(4)
+        self.display.update_rows(self.framebuffer, range(self.framebuffer.height))
+        self.program_counter += 2
+
+    def _00FC(self, x, y, n, address, byte):
+        """Scroll the display left 4 pixels. SUPER-CHIP."""
+        self.framebuffer.scroll_left(4)
+        self.display.update_rows(self.framebuffer, range(self.framebuffer.height))
+        self.program_counter += 2
+
+    def _00FD(self, x, y, n, address, byte):
+        """Exit the interpreter. SUPER-CHIP. Execution stops as it does after an error, without reporting one."""
+        self.error = True
+
+    def _00FE(self, x, y, n, address, byte):
+        """Switch to the 64x32 low resolution mode and clear the display. SUPER-CHIP."""
+        self.set_resolution(*LOW_RESOLUTION)
+        self.program_counter += 2
+
+    def _00FF(self, x, y, n, address, byte):
+        """Switch to the 128x64 high resolution mode and clear the display. SUPER-CHIP."""
+        self.set_resolution(*HIGH_RESOLUTION)
+        self.program_counter += 2
 
     def _1nnn(self, x, y, n, address, byte):
         """Jump to location at address. The interpreter sets the program counter to address."""
+        if self.program_counter - address in (2, 4):
+            self.check_idle_loop(address, self.program_counter)
         self.program_counter = address
 
     def _2nnn(self, x, y, n, address, byte):
-        """Call subroutine at nnn. The interpreter increments the stack pointer, then puts the current PC on the top
-        of the stack. The PC is then set to nnn. """
-        self.stack_pointer += 1
+        """Call subroutine at nnn. The interpreter puts the current PC on the top of the stack, then increments the
+        stack pointer. The PC is then set to nnn. """
+        if self.stack_pointer == len(self.stack):
+            self._stack_out_of_range()
+            return
         self.stack[self.stack_pointer] = self.program_counter
+        self.stack_pointer += 1
         self.program_counter = address
 
     def _3xkk(self, x, y, n, address, byte):
         """Skip next instruction if Vx = byte. The interpreter compares register Vx to byte, and if they are equal,
         increments the program counter by 2. """
         if self.register_v[x] == byte:
-            self.program_counter += 4
+            self.skip_instruction()
         else:
             self.program_counter += 2
 
@@ -248,7 +495,7 @@ class Interpreter:
         """Skip next instruction if Vx != kk. The interpreter compares register Vx to kk, and if they are not equal,
         increments the program counter by 2. """
         if self.register_v[x] != byte:
-            self.program_counter += 4
+            self.skip_instruction()
         else:
             self.program_counter += 2
 
@@ -256,10 +503,36 @@ class Interpreter:
         """Skip next instruction if Vx = Vy. The interpreter compares register Vx to register Vy, and if they are
         equal, increments the program counter by 2. """
         if self.register_v[x] == self.register_v[y]:
-            self.program_counter += 4
+            self.skip_instruction()
         else:
             self.program_counter += 2
 
+    def _5xy2(self, x, y, n, address, byte):
+        """Store registers Vx through Vy in memory starting at location I, in reverse when x > y. I is left as it
+        is. XO-CHIP. """
+        count = abs(x - y) + 1
+        if self.register_i + count > len(self.memory_buffer):
+            self._memory_out_of_range()
+            return
+        registers = self.register_v[x:y + 1] if x <= y else self.register_v[y:x + 1][::-1]
+        self.memory_buffer[self.register_i:self.register_i + count] = registers
+        self.invalidate_memory(self.register_i, count)
+        self.program_counter += 2
+
+    def _5xy3(self, x, y, n, address, byte):
+        """Read registers Vx through Vy from memory starting at location I, in reverse when x > y. I is left as it
+        is. XO-CHIP. """
+        count = abs(x - y) + 1
+        if self.register_i + count > len(self.memory_buffer):
+            self._memory_out_of_range()
+            return
+        values = self.memory_buffer[self.register_i:self.register_i + count]
+        if x <= y:
+            self.register_v[x:y + 1] = values
+        else:
+            self.register_v[y:x + 1] = values[::-1]
+        self.program_counter += 2
+
     def _6xkk(self, x, y, n, address, byte):
         """Set Vx = kk. The interpreter puts the value kk into register Vx."""
         self.register_v[x] = byte
@@ -267,7 +540,7 @@ class Interpreter:
 
     def _7xkk(self, x, y, n, address, byte):
         """Set Vx = Vx + kk. Adds the value kk to the value of register Vx, then stores the result in Vx."""
-        self.register_v[x] += byte
+        self.register_v[x] = (self.register_v[x] + byte) & 0xFF
         self.program_counter += 2
 
     def _8xy0(self, x, y, n, address, byte):
@@ -277,80 +550,67 @@ class Interpreter:
 
     def _8xy1(self, x, y, n, address, byte):
         """Set Vx = Vx OR Vy. Performs a bitwise OR on the values of Vx and Vy, then stores the result in Vx."""
-        self.register_v[x] = self.register_v[x] | self.register_v[y]
+        self.register_v[x] |= self.register_v[y]
         self.program_counter += 2
 
     def _8xy2(self, x, y, n, address, byte):
         """Set Vx = Vx AND Vy. Performs a bitwise AND on the values of Vx and Vy, then stores the result in Vx."""
-        self.register_v[x] = self.register_v[x] & self.register_v[y]
+        self.register_v[x] &= self.register_v[y]
         self.program_counter += 2
 
     def _8xy3(self, x, y, n, address, byte):
         """Set Vx = Vx XOR Vy. Performs a bitwise exclusive OR on the values of Vx and Vy, then stores the result in
         Vx. """
-        self.register_v[x] = self.register_v[x] ^ self.register_v[y]
+        self.register_v[x] ^= self.register_v[y]
         self.program_counter += 2
 
     def _8xy4(self, x, y, n, address, byte):
         """Set Vx = Vx + Vy, set VF = carry. The values of Vx and Vy are added together. If the result is greater
         than 8 bits (i.e., > 255,) VF is set to 1, otherwise 0. Only the lowest 8 bits of the result are kept,
         and stored in Vx. """
-        temp = self.register_v[x]
-        self.register_v[x] += self.register_v[y]
-        if temp > self.register_v[x]:
-            # There was an overflow, which is OK
-            self.register_v[0xF] = 0x01
-        else:
-            self.register_v[0xF] = 0x00
+        # VF is written last so the flag wins when x is F
+        total = self.register_v[x] + self.register_v[y]
+        self.register_v[x] = total & 0xFF
+        self.register_v[0xF] = total >> 8
         self.program_counter += 2
 
     def _8xy5(self, x, y, n, address, byte):
         """Set Vx = Vx - Vy, set VF = NOT borrow. If Vx > Vy, then VF is set to 1, otherwise 0. Then Vy is subtracted
         from Vx, and the results stored in Vx. """
-        if self.register_v[x] > self.register_v[y]:
-            self.register_v[0xF] = 0x01
-        else:
-            self.register_v[0xF] = 0x00
-        self.register_v[x] -= self.register_v[y]
+        not_borrow = 1 if self.register_v[x] >= self.register_v[y] else 0
+        self.register_v[x] = (self.register_v[x] - self.register_v[y]) & 0xFF
+        self.register_v[0xF] = not_borrow
         self.program_counter += 2
 
     def _8xy6(self, x, y, n, address, byte):
         """Set Vx = Vx SHR 1. If the least-significant bit of Vx is 1, then VF is set to 1, otherwise 0. Then Vx is
         divided by 2. """
-        if self.register_v[x] & 0b1:
-            self.register_v[0xF] = 0x01
-        else:
-            self.register_v[0xF] = 0x00
-        self.register_v[x] = self.register_v[x] / 2
+        least_significant_bit = self.register_v[x] & 0b1
+        self.register_v[x] >>= 1
+        self.register_v[0xF] = least_significant_bit
         self.program_counter += 2
 
     def _8xy7(self, x, y, n, address, byte):
         """Set Vx = Vy - Vx, set VF = NOT borrow. If Vy > Vx, then VF is set to 1, otherwise 0. Then Vx is subtracted
         from Vy, and the results stored in Vx. """
-        if self.register_v[y] > self.register_v[x]:
-            self.register_v[0xF] = 0x01
-        else:
-            self.register_v[0xF] = 0x00
-        self.register_v[x] = self.register_v[y] - self.register_v[x]
+        not_borrow = 1 if self.register_v[y] >= self.register_v[x] else 0
+        self.register_v[x] = (self.register_v[y] - self.register_v[x]) & 0xFF
+        self.register_v[0xF] = not_borrow
         self.program_counter += 2
 
     def _8xyE(self, x, y, n, address, byte):
         """Set Vx = Vx SHL 1. If the most-significant bit of Vx is 1, then VF is set to 1, otherwise to 0. Then Vx is
         multiplied by 2. """
-        # Using string binary representation to check
-        bin_string = bin(self.register_v[x])
-        if len(bin_string) == 10 and int(bin_string[2]) == 1:
-            self.register_v[0xF] = 0x01
-        else:
-            self.register_v[0xF] = 0x00
-        self.register_v[x] *= 2
+        most_significant_bit = self.register_v[x] >> 7
+        self.register_v[x] = (self.register_v[x] << 1) & 0xFF
+        self.register_v[0xF] = most_significant_bit
         self.program_counter += 2
 
     def _9xy0(self, x, y, n, address, byte):
         """Skip next instruction if Vx != Vy. The values of Vx and Vy are compared, and if they are not equal,
         the program counter is increased by 2. """
         if self.register_v[x] != self.register_v[y]:
-            self.program_counter += 4
+            self.skip_instruction()
         else:
             self.program_counter += 2
 
@@ -361,12 +621,12 @@ class Interpreter:
 
     def _Bnnn(self, x, y, n, address, byte):
         """Jump to location nnn + V0. The program counter is set to nnn plus the value of V0."""
-        self.program_counter = address + self.register_v[0x0]
+        self.program_counter = (address + self.register_v[0x0]) & 0xFFF
 
     def _Cxkk(self, x, y, n, address, byte):
         """Set Vx = random byte AND kk. The interpreter generates a random number from 0 to 255, which is then ANDed
         with the value kk. The results are stored in Vx. """
-        random_byte = random.randint(0, 255)
+        random_byte = self.random.randint(0, 255)
         self.register_v[x] = random_byte & byte
         self.program_counter += 2
 
@@ -376,25 +636,25 @@ class Interpreter:
         at coordinates (Vx, Vy). Sprites are XORed onto the existing screen. If this causes any pixels to be erased,
         VF is set to 1, otherwise it is set to 0. If the sprite is positioned so part of it is outside the
         coordinates of the display, it wraps around to the opposite side of the screen. """
-        self.register_v[0xF] = 0
-        for j in range(n):
-            # Add padding to fit 8 bits
-            sprite = format(self.memory_buffer[self.register_i + j], '#010b')[2:]
-            for i in range(8):
-                vx = (self.register_v[x] + i) % self.display.width
-                vy = self.display.height - ((self.register_v[y] + j) % self.display.height) - 1
-                pixel_state = self.display.get_pixel(vx, vy)
-                if pixel_state & int(sprite[i]) == 1:
-                    # A sprite was erased
-                    self.register_v[0xF] = 1
-                self.display.set_pixel(vx, vy, int(sprite[i]) ^ pixel_state)
+        sprite = self.memory_buffer[self.register_i:self.register_i + n]
+        collision, rows = self.framebuffer.draw_sprite(self.register_v[x], self.register_v[y], sprite)
+        self.register_v[0xF] = collision
+        self.display.update_rows(self.framebuffer, rows)
+        self.program_counter += 2
+
+    def _Dxy0(self, x, y, n, address, byte):
+        """Display a 16x16 sprite from the 32 bytes starting at I at (Vx, Vy), set VF = collision. SUPER-CHIP."""
+        sprite = self.memory_buffer[self.register_i:self.register_i + 32]
+        collision, rows = self.framebuffer.draw_sprite(self.register_v[x], self.register_v[y], sprite, 16)
+        self.register_v[0xF] = collision
+        self.display.update_rows(self.framebuffer, rows)
         self.program_counter += 2
 
     def _Ex9E(self, x, y, n, address, byte):
         """Skip next instruction if key with the value of Vx is pressed. Checks the keyboard, and if the key
         corresponding to the value of Vx is currently in the down position, PC is increased by 2. """
         if self.keyboard.keydown and self.keyboard.key == self.register_v[x]:
-            self.program_counter += 4
+            self.skip_instruction()
         else:
             self.program_counter += 2
         return
@@ -404,7 +664,7 @@ class Interpreter:
         corresponding to the value of Vx is currently in the up position, PC is increased by 2. """
         # Check if key pressed doesn't match or there is no key pressed
         if (self.keyboard.keydown and self.keyboard.key != self.register_v[x]) or not self.keyboard.keydown:
-            self.program_counter += 4
+            self.skip_instruction()
         else:
             self.program_counter += 2
         return
@@ -430,42 +690,77 @@ class Interpreter:
     def _Fx18(self, x, y, n, address, byte):
         """Set sound timer = Vx. ST is set equal to the value of Vx."""
         self.register_s = self.register_v[x]
-        if self.debug:
-            print("Playing audio of duration: ", self.register_s / 60.0)
-        self.audio.play_square_wave(self.register_s / 60.0)
+        # The tone plays in the background until the sound timer runs out
+        self.audio.set_tone(self.register_s > 0)
         self.program_counter += 2
         return
 
     def _Fx1E(self, x, y, n, address, byte):
         """Set I = I + Vx. The values of I and Vx are added, and the results are stored in I."""
-        self.register_i += self.register_v[x]
+        self.register_i = (self.register_i + self.register_v[x]) & 0xFFFF
         self.program_counter += 2
 
     def _Fx29(self, x, y, n, address, byte):
         """Set I = location of sprite for digit Vx. The value of I is set to the location for the hexadecimal sprite
         corresponding to the value of Vx. """
-        self.register_i = self.register_v[x] * 5
+        self.register_i = (self.register_v[x] & 0xF) * 5
+        self.program_counter += 2
+
+    def _Fx30(self, x, y, n, address, byte):
+        """Set I = location of the large sprite for digit Vx. SUPER-CHIP."""
+        self.register_i = len(self.sprites) + (self.register_v[x] & 0xF) * 10
         self.program_counter += 2
 
     def _Fx33(self, x, y, n, address, byte):
         """Store BCD representation of Vx in memory locations I, I+1, and I+2. The interpreter takes the decimal
         value of Vx, and places the hundreds digit in memory at location in I, the tens digit at location I+1,
         and the ones digit at location I+2. """
+        if self.register_i + 3 > len(self.memory_buffer):
+            self._memory_out_of_range()
+            return
         decimal = self.register_v[x]
-        self.memory_buffer[self.register_i] = int(decimal / 100)
-        self.memory_buffer[self.register_i + 1] = int((decimal % 100) / 10)
+        self.memory_buffer[self.register_i] = decimal // 100
+        self.memory_buffer[self.register_i + 1] = decimal // 10 % 10
         self.memory_buffer[self.register_i + 2] = decimal % 10
+        self.invalidate_memory(self.register_i, 3)
         self.program_counter += 2
 
     def _Fx55(self, x, y, n, address, byte):
         """Store registers V0 through Vx in memory starting at location I. The interpreter copies the values of
         registers V0 through Vx into memory, starting at the address in I. """
-        for i in range(x + 1):
-            self.memory_buffer[self.register_i + i] = self.register_v[i]
+        if self.register_i + x + 1 > len(self.memory_buffer):
+            self._memory_out_of_range()
+            return
+        self.memory_buffer[self.register_i:self.register_i + x + 1] = self.register_v[:x + 1]
+        self.invalidate_memory(self.register_i, x + 1)
         self.program_counter += 2
 
     def _Fx65(self, x, y, n, address, byte):
         """The interpreter reads values from memory starting at location I into registers V0 through Vx. """
-        for i in range(x + 1):
-            self.register_v[i] = self.memory_buffer[self.register_i + i]
+        if self.register_i + x + 1 > len(self.memory_buffer):
+            self._memory_out_of_range()
+            return
+        self.register_v[:x + 1] = self.memory_buffer[self.register_i:self.register_i + x + 1]
         self.program_counter += 2
+
+    def _Fx75(self, x, y, n, address, byte):
+        """Store registers V0 through Vx in the flag registers. SUPER-CHIP."""
+        self.flags[:x + 1] = self.register_v[:x + 1]
+        self.program_counter += 2
+
+    def _Fx85(self, x, y, n, address, byte):
+        """Read registers V0 through Vx from the flag registers. SUPER-CHIP."""
+        self.register_v[:x + 1] = self.flags[:x + 1]
+        self.program_counter += 2
+
+    def _F000(self, x, y, n, address, byte):
+        """Set I = the 16-bit address in the following two bytes. XO-CHIP. Memory grows to 64 KB the first time it's
+        used. """
+        if len(self.memory_buffer) < self.extended_memory_size:
+            self.extend_memory()
+        memory = self.memory_buffer
+        if self.program_counter + 4 > len(memory):
+            self._memory_out_of_range()
+            return
+        self.register_i = memory[self.program_counter + 2] << 8 | memory[self.program_counter + 3]
+        self.program_counter += 4
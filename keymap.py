@@ -61,10 +61,19 @@ class Keymap:
         # Inverse dictionary for removing old keys mapped to the target hex value
         self.inverse_keyboard = {value: key for key, value in self.keyboard.items()}
 
-        # Current hex key that is down
+        # Keys held down, bit k is set while hex key k is down. Written by tkinter events on the UI thread and read
+        # by the interpreter's thread when it polls.
+        self.mask = 0
+        # Most recently pressed hex key
+        self.last_key = 0
+
+        # Current hex key that is down, as seen by the interpreter
         self.key = 0
         self.keydown = False
 
+        # Print key events
+        self.debug = False
+
         # Dictionary of tk buttons
         self.button = {}
 
@@ -119,15 +128,28 @@ class Keymap:
         self.target_key = int(hex_value, 16)
         self.listening = True
 
+    def poll(self, instruction_count):
+        """Takes the current key from the bitmask, the interpreter only sees one key at a time"""
+        mask = self.mask
+        if mask >> self.last_key & 1:
+            self.key = self.last_key
+        elif mask:
+            # The newest key was released while older ones are still held
+            self.key = (mask & -mask).bit_length() - 1
+        self.keydown = mask != 0
+
     def process_keypress(self, event):
         if event.char in self.keyboard:
-            print('Hex key down: ', self.keyboard[event.char])
-            self.key = self.keyboard[event.char]
-            self.keydown = True
+            if self.debug:
+                print('Hex key down: ', self.keyboard[event.char])
+            self.last_key = self.keyboard[event.char]
+            self.mask |= 1 << self.last_key
 
     def process_keyrelease(self, event):
-        print('Hex key released: ', self.keyboard[event.char])
-        self.keydown = False
+        if event.char in self.keyboard:
+            if self.debug:
+                print('Hex key released: ', self.keyboard[event.char])
+            self.mask &= ~(1 << self.keyboard[event.char])
 
     def add_key(self, event):
         """Adds a key to the keymap"""
@@ -0,0 +1,103 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import io
+import sys
+import time
+import headless
+
+# Opcode loops to time, each one's setup runs once and its body is repeated and followed by a jump back to the start
+# of the loop. Calls are timed together with the return at 0x300, the only opcode timed with another one.
+opcodes = [
+    ('00E0', [], [0x00E0]),
+    ('1nnn', [], [0x1202]),
+    ('2nnn+00EE', [], [0x2300]),
+    ('3xkk', [], [0x3301]),
+    ('4xkk', [], [0x4300]),
+    ('5xy0', [], [0x5340]),
+    ('6xkk', [], [0x6312]),
+    ('7xkk', [], [0x73F1]),
+    ('8xy0', [], [0x8340]),
+    ('8xy1', [], [0x8341]),
+    ('8xy2', [], [0x8342]),
+    ('8xy3', [], [0x8343]),
+    ('8xy4', [], [0x8344]),
+    ('8xy5', [], [0x8345]),
+    ('8xy6', [], [0x8346]),
+    ('8xy7', [], [0x8347]),
+    ('8xyE', [], [0x834E]),
+    ('9xy0', [], [0x9340]),
+    ('Annn', [], [0xA400]),
+    ('Cxkk', [], [0xC3FF]),
+    ('Dxyn', [0xA000], [0xD345]),
+    ('Ex9E', [], [0xE39E]),
+    ('ExA1', [], [0xE3A1]),
+    ('Fx07', [], [0xF307]),
+    ('Fx15', [], [0xF315]),
+    ('Fx1E', [], [0xF31E]),
+    ('Fx29', [], [0xF329]),
+    ('Fx33', [0xA400], [0xF333]),
+    ('Fx55', [0xA400], [0xFF55]),
+    ('Fx65', [0xA400], [0xFF65]),
+]
+
+# Times each opcode is repeated inside the loop
+repeat = 16
+
+
+def assemble(setup, body):
+    """Builds a ROM which runs the setup once and then loops over the repeated opcode body"""
+    loop = 0x202 + 2 * len(setup)
+    program = [0x6305] + setup + body * repeat + [0x1000 | loop]
+    program += [0x0000] * ((0x300 - 0x200) // 2 - len(program)) + [0x00EE]
+    return b''.join(opcode.to_bytes(2, 'big') for opcode in program)
+
+
+def time_opcode(setup, body, instructions, engine='interpreter'):
+    """Returns the average nanoseconds spent per executed instruction, skipped idle loops don't count"""
+    interpreter = headless.create_interpreter(engine=engine)
+    interpreter.load_program_to_memory(io.BytesIO(assemble(setup, body)))
+    interpreter.execute_cycles(len(setup) + 1)
+    start = time.perf_counter()
+    executed = interpreter.instruction_count - interpreter.idle_cycles
+    interpreter.execute_cycles(instructions)
+    elapsed = time.perf_counter() - start
+    executed = interpreter.instruction_count - interpreter.idle_cycles - executed
+    return elapsed * 1e9 / executed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m microbenchmark', description='Time each Chip-8 opcode')
+    parser.add_argument('-i', '--instructions', type=int, default=100000, help='instructions per opcode')
+    parser.add_argument('-e', '--engine', choices=headless.engines, default='interpreter')
+    args = parser.parse_args(argv)
+    print("%-12s %10s" % ("Opcode", "ns/instr"))
+    for name, setup, body in opcodes:
+        print("%-12s %10.0f" % (name, time_opcode(setup, body, args.instructions, args.engine)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+import struct
+from array import array
+import savestate
+
+# Binary movie layout, all fields are little-endian:
+#   header  magic, format version, SHA-1 of the ROM, SHA-1 of the framebuffer after the last frame,
+#           save state length, frame count, event count
+#   frames  instructions executed in each frame
+#   events  frame, instruction count, hex key and whether it's down
+# followed by the save state the recording starts from
+MAGIC = b'C8MV'
+VERSION = 1
+HEADER = struct.Struct('<4sH20s20sIII')
+EVENT = struct.Struct('<IQB?')
+
+
+class MovieError(ValueError):
+    """Raised when a movie can't be read or played"""
+
+
+def framebuffer_digest(interpreter):
+    return hashlib.sha1(interpreter.framebuffer.buffer).digest()
+
+
+class Movie:
+    def __init__(self, rom_hash, state):
+        """Keypad input recorded from a save state. Replaying it reproduces the recording exactly, regardless of
+        the clock rate or host speed it was recorded at. """
+        self.rom_hash = rom_hash
+        # Save state the recording starts from
+        self.state = state
+        # Instructions executed in each frame
+        self.frames = array('I')
+        # (frame, instruction count, hex key, pressed) keypad changes, in the order they were polled
+        self.events = []
+        # SHA-1 of the framebuffer after the last frame
+        self.final_digest = bytes(20)
+
+
+def encode(movie):
+    """Serializes a movie to bytes"""
+    return b''.join([
+        HEADER.pack(MAGIC, VERSION, movie.rom_hash, movie.final_digest, len(movie.state), len(movie.frames),
+                    len(movie.events)),
+        struct.pack('<%dI' % len(movie.frames), *movie.frames),
+        b''.join(EVENT.pack(*event) for event in movie.events),
+        movie.state,
+    ])
+
+
+def decode(data):
+    """Reads a movie created by encode"""
+    try:
+        magic, version, rom_hash, final_digest, state_length, frame_count, event_count = \
+            HEADER.unpack_from(data, 0)
+    except struct.error:
+        raise MovieError("Not a movie")
+    if magic != MAGIC:
+        raise MovieError("Not a movie")
+    if version != VERSION:
+        raise MovieError("Unsupported movie version " + str(version))
+    offset = HEADER.size
+    if len(data) != offset + 4 * frame_count + EVENT.size * event_count + state_length:
+        raise MovieError("Movie is truncated")
+    movie = Movie(rom_hash, bytes(data[len(data) - state_length:]))
+    movie.final_digest = final_digest
+    movie.frames = array('I', struct.unpack_from('<%dI' % frame_count, data, offset))
+    offset += 4 * frame_count
+    movie.events = [EVENT.unpack_from(data, offset + i * EVENT.size) for i in range(event_count)]
+    return movie
+
+
+class MovieRecorder:
+    def __init__(self, interpreter, keypad):
+        """Keypad which forwards another keypad to the interpreter and records every change it sees. Install it
+        as the interpreter's keyboard, recording starts from the current state. """
+        self.interpreter = interpreter
+        self.keypad = keypad
+
+        # State the interpreter last saw
+        self.key = keypad.key
+        self.keydown = keypad.keydown
+
+        self.start()
+
+    def start(self):
+        interpreter = self.interpreter
+        self.movie = Movie(interpreter.rom_hash, savestate.save(interpreter))
+        self.start_frame = interpreter.frame_count
+        # Instruction count at the end of each recorded frame
+        self.frame_ends = [interpreter.instruction_count]
+
+    def poll(self, instruction_count):
+        frame = self.interpreter.frame_count - self.start_frame
+        if frame < 0:
+            # Rewound to before the recording started, start over from here
+            self.start()
+            frame = 0
+        self.truncate(frame, instruction_count)
+
+        self.keypad.poll(instruction_count)
+        if self.keypad.key != self.key or self.keypad.keydown != self.keydown:
+            self.key = self.keypad.key
+            self.keydown = self.keypad.keydown
+            self.movie.events.append((frame, instruction_count, self.key, self.keydown))
+
+    def truncate(self, frame, instruction_count):
+        """Brings the recording up to the given point. A rewind or an earlier save state can take the interpreter
+        back, anything recorded after that point is forgotten. """
+        del self.frame_ends[frame + 1:]
+        events = self.movie.events
+        while events and events[-1][:2] >= (frame, instruction_count):
+            events.pop()
+        # Frames which ended since the last poll, nothing runs between a timer tick and the next poll
+        while len(self.frame_ends) <= frame:
+            self.frame_ends.append(instruction_count)
+
+    def stop(self):
+        """Finishes the recording at the end of the last completed frame and returns the movie"""
+        interpreter = self.interpreter
+        frame = max(0, interpreter.frame_count - self.start_frame)
+        self.truncate(frame, interpreter.instruction_count)
+        movie = self.movie
+        movie.frames = array('I', [end - start for start, end in zip(self.frame_ends, self.frame_ends[1:])])
+        movie.final_digest = framebuffer_digest(interpreter)
+        return movie
+
+
+class MoviePlayer:
+    def __init__(self, movie):
+        """Keypad which plays back a movie, install it as the interpreter's keyboard and call start"""
+        self.movie = movie
+        self.next_event = 0
+        # Frame being played
+        self.frame = 0
+
+        # Current hex key that is down
+        self.key = 0
+        self.keydown = False
+
+    def start(self, interpreter):
+        """Restores the state the movie was recorded from, the interpreter must have the same ROM loaded"""
+        if self.movie.rom_hash != interpreter.rom_hash:
+            raise MovieError("Movie was recorded with a different ROM")
+        savestate.load(interpreter, self.movie.state)
+        self.next_event = 0
+        self.frame = 0
+
+    def poll(self, instruction_count):
+        """Applies every event recorded at or before the current frame and instruction count"""
+        events = self.movie.events
+        while self.next_event < len(events) and events[self.next_event][:2] <= (self.frame, instruction_count):
+            _, _, self.key, self.keydown = events[self.next_event]
+            self.next_event += 1
+
+    def finished(self):
+        return self.frame >= len(self.movie.frames)
+
+    def run_frame(self, interpreter):
+        """Runs the next recorded frame, stopping at every instruction count where the input changed"""
+        events = self.movie.events
+        target = interpreter.instruction_count + self.movie.frames[self.frame]
+        while not interpreter.error:
+            count = interpreter.instruction_count
+            stop = target
+            if self.next_event < len(events) and events[self.next_event][0] == self.frame:
+                stop = min(stop, events[self.next_event][1])
+            elif count >= target:
+                break
+            # The keypad is polled before anything runs, so an event due now is applied even if nothing executes
+            executed = interpreter.run_cycles(max(0, stop - count))
+            if executed == 0 and (count >= target or interpreter.wait_for_key):
+                break
+        interpreter.tick_timers()
+        self.frame += 1
+
+    def play(self, interpreter):
+        """Plays the rest of the movie, returns whether the final screen matches the recording"""
+        while not self.finished() and not interpreter.error:
+            self.run_frame(interpreter)
+        return framebuffer_digest(interpreter) == self.movie.final_digest
@@ -0,0 +1,208 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import collections
+import itertools
+import json
+import time
+
+
+def opcode_name(handler):
+    """Handler functions are named after their opcode pattern, e.g. _8xy4"""
+    return handler.__name__.lstrip('_')
+
+
+class Profiler:
+    def __init__(self, interpreter, controller=None):
+        """Collects per-opcode counts and times, a hot program counter histogram, draw calls per frame, frame times
+        and the scheduler's per-frame instruction budget. Attaching swaps in an instrumented execution loop, so
+        nothing is measured or paid for while detached. """
+        self.interpreter = interpreter
+        # Completed frames whose draws, times and budgets are kept, a minute at 60 Hz
+        self.history_frames = 3600
+        # Cycle controller of the scheduler running the interpreter, if any
+        self.controller = controller
+        # Whether the instrumented methods are installed
+        self.attached = False
+
+        self.reset()
+
+    def reset(self):
+        # Executions and cumulative nanoseconds for each handler
+        self.counts = {}
+        self.times = {}
+        # Executions of the instruction at each address
+        self.pc_counts = [0] * 0x10000
+        # Sprites drawn in the current frame
+        self.draws = 0
+        # Nanoseconds spent executing instructions in the current frame
+        self.frame_time = 0
+        # Completed frames, the per-frame statistics below only keep the most recent ones
+        self.frames = 0
+        # Draw calls and execution time of each recent frame
+        self.frame_draws = collections.deque(maxlen=self.history_frames)
+        self.frame_times = collections.deque(maxlen=self.history_frames)
+        # Instruction budget the controller gave each recent frame
+        self.frame_budgets = collections.deque(maxlen=self.history_frames)
+
+    def attach(self):
+        """Routes instruction execution and timer ticks through the profiler"""
+        if self.attached:
+            return
+        # Instance attributes shadow the class methods, deleting them restores whatever was there before
+        self.previous_execute_cycles = self.interpreter.__dict__.get('execute_cycles')
+        self.interpreter.execute_cycles = self.execute_cycles
+        self.interpreter.tick_timers = self.tick_timers
+        self.attached = True
+
+    def detach(self):
+        if not self.attached:
+            return
+        interpreter = self.interpreter
+        if self.previous_execute_cycles is not None:
+            interpreter.execute_cycles = self.previous_execute_cycles
+        else:
+            del interpreter.execute_cycles
+        del interpreter.tick_timers
+        self.attached = False
+
+    def execute_cycles(self, cycles):
+        """Interpreter.execute_cycles with every instruction counted and timed"""
+        interpreter = self.interpreter
+        counts = self.counts
+        times = self.times
+        pc_counts = self.pc_counts
+        clock = time.perf_counter_ns
+        # Dxy0 has its own handler for 16x16 sprites
+        draws = (interpreter.dispatch(0xD001)[0], interpreter.dispatch(0xD000)[0])
+        start = interpreter.instruction_count
+        frame_start = clock()
+        for i in range(cycles):
+            program_counter = interpreter.program_counter
+            try:
+                entry = interpreter.decode_cache[program_counter]
+            except IndexError:
+                # Past the end of memory, decoding reports it
+                entry = None
+            if entry is None:
+                entry = interpreter.decode_instruction(program_counter)
+            handler, x, y, n, address, byte = entry
+            before = clock()
+            handler(interpreter, x, y, n, address, byte)
+            elapsed = clock() - before
+            interpreter.instruction_count += 1
+            counts[handler] = counts.get(handler, 0) + 1
+            times[handler] = times.get(handler, 0) + elapsed
+            if program_counter < len(pc_counts):
+                pc_counts[program_counter] += 1
+            if handler in draws:
+                self.draws += 1
+            if interpreter.error or interpreter.wait_for_key:
+                break
+        self.frame_time += clock() - frame_start
+        # Every instruction is measured, idle loops run rather than being skipped
+        interpreter.idle_loop = 0
+        return interpreter.instruction_count - start
+
+    def tick_timers(self):
+        """Closes the profiler's frame and ticks the interpreter's timers"""
+        self.frames += 1
+        self.frame_draws.append(self.draws)
+        self.frame_times.append(self.frame_time)
+        if self.controller is not None:
+            self.frame_budgets.append(self.controller.cycles)
+        self.draws = 0
+        self.frame_time = 0
+        type(self.interpreter).tick_timers(self.interpreter)
+
+    def frame_time_percentiles(self, fractions=(0.5, 0.9, 0.99)):
+        """Milliseconds spent executing instructions per recent frame, at each fraction"""
+        frame_times = sorted(self.frame_times)
+        if not frame_times:
+            return {fraction: 0.0 for fraction in fractions}
+        return {fraction: frame_times[min(len(frame_times) - 1, int(fraction * len(frame_times)))] / 1e6
+                for fraction in fractions}
+
+    def hot_addresses(self, count=16):
+        """The most executed addresses and their execution counts"""
+        used = [(executions, address) for address, executions in enumerate(self.pc_counts) if executions]
+        used.sort(reverse=True)
+        return [(address, executions) for executions, address in used[:count]]
+
+    def report(self):
+        """Collected statistics as a JSON serializable dictionary"""
+        total = sum(self.counts.values())
+        opcodes = {}
+        for handler, executions in sorted(self.counts.items(), key=lambda item: -self.times[item[0]]):
+            opcodes[opcode_name(handler)] = {
+                'count': executions,
+                'total_ms': self.times[handler] / 1e6,
+                'ns_per_instruction': self.times[handler] / executions,
+            }
+        recent = len(self.frame_draws)
+        percentiles = self.frame_time_percentiles()
+        report = {
+            'instructions': total,
+            'frames': self.frames,
+            # Frames the per-frame statistics are taken from
+            'recent_frames': recent,
+            'opcodes': opcodes,
+            'hot_addresses': {'0x%03X' % address: executions for address, executions in self.hot_addresses()},
+            'draws_per_frame': sum(self.frame_draws) / recent if recent else 0.0,
+            'frame_ms': {'p50': percentiles[0.5], 'p90': percentiles[0.9], 'p99': percentiles[0.99]},
+        }
+        controller = self.controller
+        if controller is not None:
+            budgets = self.frame_budgets
+            report['cycle_budget'] = {
+                'current': controller.cycles,
+                'min_cycles': controller.min_cycles,
+                'max_cycles': controller.max_cycles,
+                # The controller's running estimate, None until it has measured a frame
+                'ns_per_instruction': controller.cost * 1e9 if controller.cost is not None else None,
+                'frame_min': min(budgets) if budgets else 0,
+                'frame_mean': sum(budgets) / len(budgets) if budgets else 0.0,
+                'frame_max': max(budgets) if budgets else 0,
+            }
+        return report
+
+    def export(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def overlay(self, frames=60):
+        """Short summary of the last frames for the window title"""
+        start = max(0, len(self.frame_times) - frames)
+        recent_times = sorted(itertools.islice(self.frame_times, start, None))
+        recent_draws = list(itertools.islice(self.frame_draws, start, None))
+        if not recent_times:
+            return "profiling"
+        hottest = max(self.times, key=self.times.get) if self.times else None
+        total_time = sum(self.times.values())
+        text = "draws/frame: %.1f ~ frame p99: %.2f ms" % (
+            sum(recent_draws) / len(recent_draws),
+            recent_times[min(len(recent_times) - 1, int(0.99 * len(recent_times)))] / 1e6)
+        if hottest is not None and total_time:
+            text += " ~ hottest: %s %.0f%%" % (opcode_name(hottest), 100 * self.times[hottest] / total_time)
+        return text
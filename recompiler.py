@@ -0,0 +1,313 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+class Block:
+    def __init__(self, start, end, length, function, source, write_length, code, handlers):
+        """A straight-line run of instructions compiled into a single Python function"""
+        # Address range [start, end) of the instructions in the block
+        self.start = start
+        self.end = end
+        # Number of Chip-8 instructions executed by one call
+        self.length = length
+        # Takes (interpreter, memory, registers) and returns the next program counter
+        self.function = function
+        # Generated Python source, kept for debugging
+        self.source = source
+        # Number of bytes written starting at I when the block ends with Fx33/Fx55
+        self.write_length = write_length
+        # Compiled module which defines the function, can be marshalled to skip compiling next time
+        self.code = code
+        # Names of the interpreter handlers the function calls, keyed by the name it calls them by
+        self.handlers = handlers
+
+
+# noinspection PyPep8Naming
+class Recompiler:
+    # Opcodes which end a block and are executed by calling the interpreter's handler
+    handler_terminators = {'_00EE', '_2nnn', '_Bnnn', '_Dxyn', '_Ex9E', '_ExA1', '_Fx0A', '_Fx33', '_Fx55',
+                           '_Fx65', '_unknown_opcode', '_00Cn', '_00Dn', '_00FB', '_00FC', '_00FD', '_00FE', '_00FF',
+                           '_5xy2', '_5xy3', '_Dxy0', '_Fx75', '_Fx85', '_F000'}
+
+    # Longest block that will be generated
+    max_block_length = 64
+
+    def __init__(self, interpreter):
+        """Dynamic recompiler which translates basic blocks of Chip-8 code into Python functions"""
+        self.interpreter = interpreter
+        # Compiled block starting at each address
+        self.blocks = []
+        # Start addresses of the blocks covering each byte of memory
+        self.block_owners = []
+        # Memory the blocks were compiled from, loading a ROM replaces it
+        self.memory_buffer = None
+
+        # Statistics
+        self.blocks_compiled = 0
+
+        self.reset()
+
+    def attach(self):
+        """Replaces the interpreter's execution loop with the recompiled one"""
+        self.interpreter.execute_cycles = self.execute_cycles
+        self.interpreter.extend_memory = self.extend_memory
+        return self
+
+    def reset(self):
+        """Drops all compiled blocks"""
+        self.memory_buffer = self.interpreter.memory_buffer
+        self.blocks = [None] * len(self.memory_buffer)
+        self.block_owners = [[] for i in range(len(self.memory_buffer))]
+
+    def extend_memory(self):
+        """Grows the interpreter's memory and the block caches with it, F000 nnnn does this in the middle of a run"""
+        interpreter = self.interpreter
+        type(interpreter).extend_memory(interpreter)
+        added = len(interpreter.memory_buffer) - len(self.blocks)
+        self.blocks.extend([None] * added)
+        self.block_owners.extend([] for i in range(added))
+
+    def invalidate_memory(self, address, length):
+        """Drops every block containing one of the written bytes"""
+        for i in range(address, min(address + length, len(self.block_owners))):
+            for start in self.block_owners[i][:]:
+                block = self.blocks[start]
+                self.blocks[start] = None
+                for j in range(block.start, min(block.end, len(self.block_owners))):
+                    self.block_owners[j].remove(start)
+
+    def execute_cycles(self, cycles):
+        """Executes whole blocks until at least the given number of instructions ran. Returns the number of
+        instructions which were executed. """
+        interpreter = self.interpreter
+        if interpreter.memory_buffer is not self.memory_buffer:
+            self.reset()
+        memory = interpreter.memory_buffer
+        registers = interpreter.register_v
+        executed = 0
+        interpreter.idle = False
+        while executed < cycles and not interpreter.error and not interpreter.wait_for_key:
+            try:
+                block = self.blocks[interpreter.program_counter]
+            except IndexError:
+                block = None
+            if block is None:
+                if interpreter.program_counter + 1 >= len(memory):
+                    # Runaway programs are stopped by the interpreter's handler, counted like its failed fetch
+                    interpreter._program_counter_out_of_range(0, 0, 0, 0, 0)
+                    executed += 1
+                    break
+                block = self.compile_block(interpreter.program_counter)
+            interpreter.program_counter = block.function(interpreter, memory, registers)
+            executed += block.length
+            if block.write_length:
+                self.invalidate_memory(interpreter.register_i, block.write_length)
+            elif interpreter.idle_loop:
+                executed += interpreter.skip_idle_loop(cycles - executed)
+        interpreter.instruction_count += executed
+        return executed
+
+    def compile_block(self, start):
+        """Generates, compiles and caches the block starting at the address"""
+        interpreter = self.interpreter
+        memory = interpreter.memory_buffer
+        # Handlers called by the generated code
+        handlers = {}
+        body = []
+        # Registers which are read before being written must be loaded on entry
+        loaded = set()
+        modified = set()
+
+        def read(*names):
+            for name in names:
+                if name not in modified:
+                    loaded.add(name)
+
+        def write(*names):
+            modified.update(names)
+
+        def write_back():
+            lines = []
+            for name in sorted(modified):
+                if name == 'i':
+                    lines.append('self.register_i = i')
+                else:
+                    lines.append('V[%d] = %s' % (int(name[1:], 16), name))
+            return lines
+
+        address = start
+        length = 0
+        write_length = 0
+        while True:
+            opcode = memory[address] << 8 | memory[address + 1]
+            handler, x, y, n, nnn, kk = interpreter.dispatch(opcode)
+            name = handler.__name__
+            vx = 'v%X' % x
+            vy = 'v%X' % y
+            length += 1
+            if name in self.handler_terminators:
+                if name == '_Fx33':
+                    write_length = 3
+                elif name == '_Fx55':
+                    write_length = x + 1
+                elif name == '_5xy2':
+                    write_length = abs(x - y) + 1
+                handlers['h_%03X' % address] = name
+                body.extend(write_back())
+                body.append('self.program_counter = %d' % address)
+                body.append('h_%03X(self, %d, %d, %d, %d, %d)' % (address, x, y, n, nnn, kk))
+                body.append('return self.program_counter')
+                # F000 is followed by its 16-bit address
+                address += 4 if name == '_F000' else 2
+                break
+            elif name == '_1nnn':
+                body.extend(write_back())
+                if address - nnn in (2, 4):
+                    body.append('self.check_idle_loop(%d, %d)' % (nnn, address))
+                body.append('return %d' % nnn)
+                address += 2
+                break
+            elif name in ('_3xkk', '_4xkk', '_5xy0', '_9xy0'):
+                if name in ('_3xkk', '_4xkk'):
+                    read(vx)
+                    condition = '%s %s %d' % (vx, '==' if name == '_3xkk' else '!=', kk)
+                else:
+                    read(vx, vy)
+                    condition = '%s %s %s' % (vx, '==' if name == '_5xy0' else '!=', vy)
+                body.extend(write_back())
+                # Skipping over F000 nnnn skips all four bytes. The skipped instruction is part of the block, so
+                # writing a different one there recompiles it.
+                skip = 6 if memory[address + 2:address + 4] == b'\xF0\x00' else 4
+                body.append('return %d if %s else %d' % (address + skip, condition, address + 2))
+                address += 4
+                break
+            elif name == '_0NNN':
+                pass
+            elif name == '_00E0':
+                body.append('self.framebuffer.clear()')
+                body.append('self.display.clear_screen()')
+            elif name == '_6xkk':
+                write(vx)
+                body.append('%s = %d' % (vx, kk))
+            elif name == '_7xkk':
+                read(vx)
+                write(vx)
+                body.append('%s = (%s + %d) & 0xFF' % (vx, vx, kk))
+            elif name == '_8xy0':
+                read(vy)
+                write(vx)
+                body.append('%s = %s' % (vx, vy))
+            elif name in ('_8xy1', '_8xy2', '_8xy3'):
+                read(vx, vy)
+                write(vx)
+                body.append('%s %s= %s' % (vx, {'_8xy1': '|', '_8xy2': '&', '_8xy3': '^'}[name], vy))
+            elif name == '_8xy4':
+                read(vx, vy)
+                write(vx, 'vF')
+                body.append('t = %s + %s' % (vx, vy))
+                body.append('%s = t & 0xFF' % vx)
+                body.append('vF = t >> 8')
+            elif name == '_8xy5':
+                read(vx, vy)
+                write(vx, 'vF')
+                body.append('t = 1 if %s >= %s else 0' % (vx, vy))
+                body.append('%s = (%s - %s) & 0xFF' % (vx, vx, vy))
+                body.append('vF = t')
+            elif name == '_8xy6':
+                read(vx)
+                write(vx, 'vF')
+                body.append('t = %s & 1' % vx)
+                body.append('%s >>= 1' % vx)
+                body.append('vF = t')
+            elif name == '_8xy7':
+                read(vx, vy)
+                write(vx, 'vF')
+                body.append('t = 1 if %s >= %s else 0' % (vy, vx))
+                body.append('%s = (%s - %s) & 0xFF' % (vx, vy, vx))
+                body.append('vF = t')
+            elif name == '_8xyE':
+                read(vx)
+                write(vx, 'vF')
+                body.append('t = %s >> 7' % vx)
+                body.append('%s = (%s << 1) & 0xFF' % (vx, vx))
+                body.append('vF = t')
+            elif name == '_Annn':
+                write('i')
+                body.append('i = %d' % nnn)
+            elif name == '_Cxkk':
+                write(vx)
+                body.append('%s = self.random.randint(0, 255) & %d' % (vx, kk))
+            elif name == '_Fx07':
+                write(vx)
+                body.append('%s = self.register_d' % vx)
+            elif name == '_Fx15':
+                read(vx)
+                body.append('self.register_d = %s' % vx)
+            elif name == '_Fx18':
+                read(vx)
+                body.append('self.register_s = %s' % vx)
+                body.append('self.audio.set_tone(%s > 0)' % vx)
+            elif name == '_Fx1E':
+                read('i', vx)
+                write('i')
+                body.append('i = (i + %s) & 0xFFFF' % vx)
+            elif name == '_Fx29':
+                read(vx)
+                write('i')
+                body.append('i = (%s & 0xF) * 5' % vx)
+            elif name == '_Fx30':
+                read(vx)
+                write('i')
+                body.append('i = %d + (%s & 0xF) * 10' % (len(interpreter.sprites), vx))
+            else:
+                raise ValueError('No translation for ' + name)
+            address += 2
+            if length >= self.max_block_length or address + 1 >= len(memory):
+                body.extend(write_back())
+                body.append('return %d' % address)
+                break
+
+        prologue = []
+        for name in sorted(loaded):
+            if name == 'i':
+                prologue.append('i = self.register_i')
+            else:
+                prologue.append('%s = V[%d]' % (name, int(name[1:], 16)))
+        source = 'def block_%03X(self, M, V):\n' % start
+        source += ''.join('    ' + line + '\n' for line in prologue + body)
+        code = compile(source, '<block 0x%03X>' % start, 'exec')
+        self.blocks_compiled += 1
+        # The block covers every byte up to the end of its last instruction
+        return self.install_block(start, address, length, source, write_length, code, handlers)
+
+    def install_block(self, start, end, length, source, write_length, code, handlers):
+        """Defines a compiled block's function and caches it for every byte it covers"""
+        # Names made available to the generated code
+        namespace = {name: getattr(type(self.interpreter), handler) for name, handler in handlers.items()}
+        exec(code, namespace)
+        block = Block(start, end, length, namespace['block_%03X' % start], source, write_length, code, handlers)
+        self.blocks[start] = block
+        for i in range(start, min(end, len(self.block_owners))):
+            self.block_owners[i].append(start)
+        return block
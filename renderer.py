@@ -35,25 +35,48 @@ import OpenGL.GL as GL
 import OpenGL.GL.shaders
 
 
+def set_viewport(display_width, display_height, window_width, window_height):
+    """Scales the display to fill the window while keeping its aspect ratio"""
+    scale = min(window_width / display_width, window_height / display_height)
+    viewport_width = int(display_width * scale)
+    viewport_height = int(display_height * scale)
+    GL.glViewport((window_width - viewport_width) // 2, (window_height - viewport_height) // 2,
+                  viewport_width, viewport_height)
+
+
+def quad_mesh(width, height):
+    """Vertex positions of a quad for every pixel in normalized device coordinates, bottom row first. Each quad is
+    listed counterclockwise from its bottom left corner. """
+    # Offsets of the four corners in pixels
+    corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], np.float32)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack([x, y], axis=-1).reshape(-1, 1, 2)
+    scale = np.array([2.0 / width, 2.0 / height], np.float32)
+    return ((pixels + corners) * scale - 1.0).astype(np.float32).ravel()
+
+
 class Renderer:
 
     def __init__(self):
         """Modern OpenGL rendering class"""
 
-        # Chip-8 display
+        # Chip-8 display, resized to match the framebuffers it's given
         self.width = 64
         self.height = 32
-
-        # Should be a multiple of 60 for proper timer operation
-        self.max_fps = 60
-
-        # Whether each pixel is on or off
-        self.display_state = [[0 for y in range(self.height)] for x in range(self.width)]
+        # Whether the GPU buffers still have the previous size
+        self.resized = False
+        # Window size, the viewport is fitted to it again after a resize
+        self.window_width = 0
+        self.window_height = 0
 
         # Objects for vertex/color buffers
         self.buffer_object = np.array([])
-        # Using 4 vertices per 'pixel'
-        self.display_buffer = np.array([0] * (4 * self.height * self.width), np.int32)
+        # Using 4 vertices per 'pixel', this is a CPU side copy of the color buffer which is uploaded once per frame
+        self.display_buffer = np.zeros(4 * self.height * self.width, np.int32)
+        # Rows of the display buffer which changed since the last upload, counted from the bottom
+        self.dirty_rows = set()
+        # Upload the whole buffer at once when more than this fraction of the rows changed
+        self.full_upload_ratio = 0.5
         self.vertex_buffer = []
         self.vertex_array_object = 0
 
@@ -128,17 +151,7 @@ class Renderer:
                                  ctypes.c_void_p(0))
         # Add vertices of 'pixels' to the buffer
         # The position of each vertex is in normalized device coordinate space
-        x_increment = 2.0 / self.width
-        y_increment = 2.0 / self.height
-        for y in range(self.height):
-            for x in range(self.width):
-                # Add each 'pixel' to the list
-                top_left = [-1.0 + (x * x_increment), -1.0 + (y * y_increment)]
-                self.vertex_buffer.extend([top_left[0], top_left[1]])
-                self.vertex_buffer.extend([top_left[0] + x_increment, top_left[1]])
-                self.vertex_buffer.extend([top_left[0] + x_increment, top_left[1] + y_increment])
-                self.vertex_buffer.extend([top_left[0], top_left[1] + y_increment])
-        self.vertex_buffer = np.array(self.vertex_buffer, np.float32)
+        self.vertex_buffer = quad_mesh(self.width, self.height)
         # sizeof float (4) * vertex components (2) * vertices in square (4) * number of 'pixels'
         GL.glBufferData(GL.GL_ARRAY_BUFFER, 4 * 2 * 4 * self.height * self.width,
                         self.vertex_buffer, GL.GL_STATIC_DRAW)
@@ -152,26 +165,244 @@ class Renderer:
                         self.display_buffer, GL.GL_DYNAMIC_DRAW)
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
 
+    def resize(self, width, height):
+        self.window_width = width
+        self.window_height = height
+        set_viewport(self.width, self.height, width, height)
+
+    def set_size(self, width, height):
+        """Switches to a display of the given size, the GPU buffers are replaced on the next render"""
+        self.width = width
+        self.height = height
+        self.display_buffer = np.zeros(4 * height * width, np.int32)
+        self.vertex_buffer = quad_mesh(width, height)
+        self.dirty_rows.clear()
+        self.resized = True
+
     def get_pixel(self, x, y):
-        return self.display_state[x][y]
+        return self.display_buffer[(y * self.width + x) * 4]
 
     def set_pixel(self, x, y, on):
-        # Get offset into buffer and update only that pixel
-        start = (y * self.width * 4 * 4) + (x * 4 * 4)
-        data = np.array([np.int32(on)] * 4, np.int32)
+        # Only the CPU side buffer is changed, the row is uploaded on the next render
+        start = (y * self.width + x) * 4
+        self.display_buffer[start:start + 4] = on
+        self.dirty_rows.add(y)
+
+    def update_rows(self, framebuffer, rows):
+        """Copies the given framebuffer rows to the display buffer, all rows are unpacked in one go"""
+        if framebuffer.width != self.width or framebuffer.height != self.height:
+            self.set_size(framebuffer.width, framebuffer.height)
+        rows = np.asarray(rows, np.intp)
+        if not len(rows):
+            return
+        packed = np.frombuffer(framebuffer.buffer, np.uint8).reshape(self.height, framebuffer.row_bytes)
+        pixels = np.unpackbits(packed[rows], axis=1)
+        # Framebuffer rows start at the top, the vertex grid starts at the bottom
+        flipped = self.height - rows - 1
+        self.display_buffer.reshape(self.height, self.width * 4)[flipped] = np.repeat(pixels, 4, axis=1)
+        self.dirty_rows.update(flipped.tolist())
+
+    def clear_screen(self):
+        self.display_buffer[:] = 0
+        self.dirty_rows.update(range(self.height))
+
+    def flush(self):
+        """Uploads the dirty rows using one glBufferSubData call per contiguous run of rows"""
+        if self.resized:
+            self.upload_buffers()
+        if not self.dirty_rows:
+            return
+        row_size = self.width * 4
+        if len(self.dirty_rows) > self.height * self.full_upload_ratio:
+            runs = [(0, self.height)]
+        else:
+            runs = []
+            for y in sorted(self.dirty_rows):
+                if runs and runs[-1][1] == y:
+                    runs[-1] = (runs[-1][0], y + 1)
+                else:
+                    runs.append((y, y + 1))
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer_object[1])
-        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, start, 4 * 4, data)
+        for start, end in runs:
+            # Size of int (4) * number of ints in the run
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, start * row_size * 4, (end - start) * row_size * 4,
+                               self.display_buffer[start * row_size:end * row_size])
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
-        # Update display state for interpreter
-        self.display_state[x][y] = on
+        self.dirty_rows.clear()
 
-    def clear_screen(self):
-        for x in range(self.width):
-            for y in range(self.height):
-                self.set_pixel(x, y, 0)
+    def upload_buffers(self):
+        """Replaces the vertex and color buffers with ones of the current size"""
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer_object[0])
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.vertex_buffer.nbytes, self.vertex_buffer, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer_object[1])
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.display_buffer.nbytes, self.display_buffer, GL.GL_DYNAMIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        set_viewport(self.width, self.height, self.window_width, self.window_height)
+        # The whole display buffer went up with the new buffer
+        self.dirty_rows.clear()
+        self.resized = False
 
     def render(self):
         """Draw each 'pixel'"""
+        self.flush()
         # Clear the color buffer first
         GL.glClear(GL.GL_COLOR_BUFFER_BIT)
         GL.glDrawArrays(GL.GL_QUADS, 0, 4 * self.height * self.width)
+
+
+class TextureRenderer:
+
+    def __init__(self, width=64, height=32):
+        """OpenGL rendering class which draws the display as a texture on a single quad"""
+
+        # Chip-8 display, resized to match the framebuffers it's given
+        self.width = width
+        self.height = height
+        # Whether the texture still has the previous size
+        self.resized = False
+        # Window size, the viewport is fitted to it again after a resize
+        self.window_width = 0
+        self.window_height = 0
+
+        # One byte per pixel, rows start at the top of the screen, uploaded once per frame when changed
+        self.pixels = np.zeros((self.height, self.width), np.uint8)
+        self.dirty = False
+
+        # Objects for the quad and the display texture
+        self.buffer_object = 0
+        self.vertex_array_object = 0
+        self.texture = 0
+
+        self.attributes = {}
+        self.shader = 0
+
+        self.vertex_shader = """
+        #version 330
+
+        in vec2 position;
+        out vec2 texture_coordinate;
+        void main()
+        {
+           // Texture rows start at the top of the screen
+           texture_coordinate = vec2(position.x + 1.0, 1.0 - position.y) / 2.0;
+           gl_Position = vec4(position, 0.0, 1.0);
+        }
+        """
+
+        self.fragment_shader = """
+        #version 330
+
+        uniform sampler2D screen;
+        in vec2 texture_coordinate;
+        out vec4 color;
+        void main()
+        {
+           // Nearest sampling, each fragment reads the texel it lies in
+           ivec2 size = textureSize(screen, 0);
+           ivec2 texel = min(ivec2(texture_coordinate * vec2(size)), size - 1);
+           if (texelFetch(screen, texel, 0).r == 0.0) {
+             color = vec4(0.1, 0.1, 0.1, 0.1);
+           } else {
+             color = vec4(1, 1, 1, 1);
+           }
+        }
+        """
+
+    def bind_shader(self):
+        """Compiles and binds the shader program"""
+        self.shader = OpenGL.GL.shaders.compileProgram(
+            OpenGL.GL.shaders.compileShader(self.vertex_shader, GL.GL_VERTEX_SHADER),
+            OpenGL.GL.shaders.compileShader(self.fragment_shader, GL.GL_FRAGMENT_SHADER)
+        )
+        GL.glUseProgram(self.shader)
+
+    def destroy(self):
+        """Frees all of the allocated OpenGL resources"""
+        GL.glBindVertexArray(0)
+        GL.glDeleteVertexArrays(1, np.array([self.vertex_array_object]))
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glDeleteBuffers(1, np.array([self.buffer_object]))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        GL.glDeleteTextures(np.array([self.texture]))
+        GL.glUseProgram(0)
+
+    def create_vertex_objects(self):
+        """Generates the fullscreen quad and the display texture"""
+        self.vertex_array_object = GL.glGenVertexArrays(1)
+        GL.glBindVertexArray(self.vertex_array_object)
+        self.buffer_object = GL.glGenBuffers(1)
+        self.attributes['position'] = GL.glGetAttribLocation(self.shader, 'position')
+        GL.glEnableVertexAttribArray(self.attributes['position'])
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer_object)
+        GL.glVertexAttribPointer(self.attributes['position'], 2, GL.GL_FLOAT, False, 0, ctypes.c_void_p(0))
+        # Triangle strip covering the viewport in normalized device coordinates
+        quad = np.array([-1.0, -1.0, 1.0, -1.0, -1.0, 1.0, 1.0, 1.0], np.float32)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, quad.nbytes, quad, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+        self.texture = GL.glGenTextures(1)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        # Rows are a single byte per pixel so they aren't 4 byte aligned in general
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_R8, self.width, self.height, 0, GL.GL_RED,
+                        GL.GL_UNSIGNED_BYTE, self.pixels)
+        GL.glUniform1i(GL.glGetUniformLocation(self.shader, 'screen'), 0)
+
+    def resize(self, width, height):
+        self.window_width = width
+        self.window_height = height
+        set_viewport(self.width, self.height, width, height)
+
+    def set_size(self, width, height):
+        """Switches to a display of the given size, the texture is replaced on the next render"""
+        self.width = width
+        self.height = height
+        self.pixels = np.zeros((height, width), np.uint8)
+        self.resized = True
+
+    def get_pixel(self, x, y):
+        return self.pixels[self.height - y - 1, x]
+
+    def set_pixel(self, x, y, on):
+        self.pixels[self.height - y - 1, x] = on
+        self.dirty = True
+
+    def update_rows(self, framebuffer, rows):
+        """Copies the given framebuffer rows to the texture data"""
+        if framebuffer.width != self.width or framebuffer.height != self.height:
+            self.set_size(framebuffer.width, framebuffer.height)
+        packed = np.frombuffer(framebuffer.buffer, np.uint8).reshape(framebuffer.height, framebuffer.row_bytes)
+        self.pixels[rows] = np.unpackbits(packed[rows], axis=1)
+        self.dirty = True
+
+    def clear_screen(self):
+        self.pixels[:] = 0
+        self.dirty = True
+
+    def flush(self):
+        """Uploads the whole texture, it's only width * height bytes"""
+        if self.resized:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_R8, self.width, self.height, 0, GL.GL_RED,
+                            GL.GL_UNSIGNED_BYTE, self.pixels)
+            set_viewport(self.width, self.height, self.window_width, self.window_height)
+            self.resized = False
+            self.dirty = False
+            return
+        if not self.dirty:
+            return
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, self.width, self.height, GL.GL_RED, GL.GL_UNSIGNED_BYTE,
+                           self.pixels)
+        self.dirty = False
+
+    def render(self):
+        """Draw the display quad"""
+        self.flush()
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+        GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
@@ -0,0 +1,109 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from collections import deque
+import numpy as np
+
+
+def encode_delta(keyframe, state):
+    """Encodes the state as runs of bytes which differ from the keyframe. The result holds the run count, the run
+    offsets and lengths as 32-bit words, then the XOR of the changed bytes. """
+    difference = np.frombuffer(state, np.uint8) ^ np.frombuffer(keyframe, np.uint8)
+    changed = np.flatnonzero(difference)
+    if len(changed) == 0:
+        return bytes(4)
+    # A new run starts wherever the changed offsets aren't consecutive
+    breaks = np.flatnonzero(np.diff(changed) > 1) + 1
+    starts = changed[np.r_[0, breaks]]
+    ends = changed[np.r_[breaks - 1, len(changed) - 1]] + 1
+    data = np.concatenate([difference[start:end] for start, end in zip(starts, ends)])
+    return (np.uint32(len(starts)).tobytes() + starts.astype('<u4').tobytes() +
+            (ends - starts).astype('<u4').tobytes() + data.tobytes())
+
+
+def decode_delta(keyframe, delta):
+    """Rebuilds the state from its keyframe and delta"""
+    state = np.frombuffer(keyframe, np.uint8).copy()
+    runs = int(np.frombuffer(delta, '<u4', 1)[0])
+    if runs:
+        starts = np.frombuffer(delta, '<u4', runs, 4).astype(np.intp)
+        lengths = np.frombuffer(delta, '<u4', runs, 4 + 4 * runs).astype(np.intp)
+        data = np.frombuffer(delta, np.uint8, offset=4 + 8 * runs)
+        # Offset of every changed byte, each run continues from its start
+        run_offsets = np.cumsum(lengths) - lengths
+        indices = np.repeat(starts - run_offsets, lengths) + np.arange(len(data))
+        state[indices] ^= data
+    return state.tobytes()
+
+
+class RewindBuffer:
+    def __init__(self, memory_limit=8 * 1024 * 1024, keyframe_interval=60):
+        """Bounded history of save states, stored as deltas against a keyframe taken every keyframe_interval
+        captures. The oldest history is dropped once memory_limit bytes are used. """
+        self.memory_limit = memory_limit
+        self.keyframe_interval = keyframe_interval
+        # Each segment is [keyframe, deltas], a delta encodes one state against the segment's keyframe
+        self.segments = deque()
+        self.memory_used = 0
+        self.states = 0
+
+    def clear(self):
+        self.segments.clear()
+        self.memory_used = 0
+        self.states = 0
+
+    def capture(self, state):
+        """Adds a state to the history"""
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or len(segment[1]) >= self.keyframe_interval - 1 or len(segment[0]) != len(state):
+            self.segments.append([bytes(state), []])
+            self.memory_used += len(state)
+        else:
+            delta = encode_delta(segment[0], state)
+            segment[1].append(delta)
+            self.memory_used += len(delta)
+        self.states += 1
+        # Keep the newest segment even if it's larger than the limit on its own
+        while self.memory_used > self.memory_limit and len(self.segments) > 1:
+            keyframe, deltas = self.segments.popleft()
+            self.memory_used -= len(keyframe) + sum(len(delta) for delta in deltas)
+            self.states -= 1 + len(deltas)
+
+    def step_back(self):
+        """Removes the newest state from the history and returns it, or None when the history is empty"""
+        if not self.segments:
+            return None
+        keyframe, deltas = self.segments[-1]
+        self.states -= 1
+        if deltas:
+            delta = deltas.pop()
+            self.memory_used -= len(delta)
+            return decode_delta(keyframe, delta)
+        self.segments.pop()
+        self.memory_used -= len(keyframe)
+        return keyframe
+
+    def seconds(self, frame_rate=60):
+        """Length of the history when one state is captured per frame"""
+        return self.states / frame_rate
@@ -0,0 +1,241 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import marshal
+import os
+import sys
+import types
+from recompiler import Recompiler
+
+# Version of the analysis files, bumped whenever their contents change meaning
+ANALYSIS_VERSION = 3
+# Marshalled code and handler names only hold for the Python which wrote them, other versions start over
+PYTHON_VERSION = tuple(sys.version_info)
+
+
+def default_directory():
+    return os.path.join(os.path.expanduser('~'), '.chip8', 'library')
+
+
+def recompiler_of(interpreter):
+    """The recompiler attached to the interpreter, if any"""
+    engine = getattr(interpreter.__dict__.get('execute_cycles'), '__self__', None)
+    return engine if isinstance(engine, Recompiler) else None
+
+
+class RomLibrary:
+    def __init__(self, directory=None):
+        """ROMs indexed by SHA-1 with their metadata, and the decode and recompiler analysis of each ROM kept on disk
+        so reopening a known ROM doesn't decode or compile anything it already has. """
+        self.directory = directory or default_directory()
+        self.index_file = os.path.join(self.directory, 'index.json')
+        # Metadata of every known ROM, keyed by the hex SHA-1 of its contents
+        self.roms = {}
+        try:
+            with open(self.index_file) as file:
+                self.roms = json.load(file)['roms']
+        except (IOError, ValueError, KeyError):
+            # A missing or damaged index just starts an empty library
+            self.roms = {}
+
+        # Memory right after the current ROM was loaded, only analysis of untouched code is saved
+        self.image = None
+        self.rom_hash = None
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written next to the index first, so a crash can't leave half a file behind
+        temporary = self.index_file + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'roms': self.roms}, file, indent=2, sort_keys=True)
+        os.replace(temporary, self.index_file)
+
+    def analysis_file(self, rom_hash):
+        return os.path.join(self.directory, 'analysis', rom_hash + '.bin')
+
+    def entry(self, rom_hash):
+        return self.roms.get(rom_hash)
+
+    def add(self, program, filename):
+        """Returns the ROM's entry, creating it the first time the ROM is seen"""
+        rom_hash = hashlib.sha1(program).hexdigest()
+        entry = self.roms.get(rom_hash)
+        if entry is None:
+            entry = {
+                'title': os.path.splitext(os.path.basename(filename))[0],
+                # Instructions per second the ROM plays best at, None leaves the current setting alone
+                'clock_rate': None,
+                'size': len(program),
+            }
+            self.roms[rom_hash] = entry
+        path = os.path.abspath(filename)
+        if entry.get('path') != path:
+            entry['path'] = path
+            self.save_index()
+        return entry
+
+    def update(self, rom_hash, **metadata):
+        self.roms[rom_hash].update(metadata)
+        self.save_index()
+
+    def open(self, interpreter, filename):
+        """Loads the ROM into the interpreter and restores its saved analysis, returns the ROM's entry"""
+        with open(filename, 'rb') as file:
+            program = file.read()
+        entry = self.add(program, filename)
+        interpreter.load_program_to_memory(io.BytesIO(program))
+        if interpreter.error:
+            return entry
+        if entry['clock_rate'] is not None:
+            interpreter.clock_rate = entry['clock_rate']
+        self.rom_hash = interpreter.rom_hash.hex()
+        self.image = bytes(interpreter.memory_buffer)
+        self.restore_analysis(interpreter)
+        return entry
+
+    def read_analysis(self, rom_hash):
+        """The saved analysis of a ROM, or None if there is none that can be used"""
+        try:
+            with open(self.analysis_file(rom_hash), 'rb') as file:
+                analysis = marshal.load(file)
+            if analysis['version'] != ANALYSIS_VERSION or tuple(analysis['python']) != PYTHON_VERSION:
+                return None
+            # Only the shape is checked here, restoring checks each entry against the ROM
+            for address, name in analysis['instructions']:
+                if not isinstance(address, int) or not isinstance(name, str):
+                    return None
+            for block in analysis['blocks']:
+                if len(block) != 7 or not isinstance(block[0], int):
+                    return None
+            return analysis
+        except (IOError, EOFError, ValueError, TypeError, KeyError):
+            return None
+
+    def restore_analysis(self, interpreter):
+        """Fills the decode cache and the recompiler's block cache from the saved analysis of the current ROM"""
+        analysis = self.read_analysis(self.rom_hash)
+        if analysis is None:
+            return
+        memory = interpreter.memory_buffer
+        # Opcodes are decoded through the shared dispatch table, the saved handler names only confirm the entries
+        # still decode the same way. Anything which doesn't check out is a cache miss and decoded when it runs.
+        for address, name in analysis['instructions']:
+            if not 0 <= address < len(memory) - 1:
+                continue
+            entry = interpreter.dispatch(memory[address] << 8 | memory[address + 1])
+            if entry[0].__name__ == name:
+                interpreter.decode_cache[address] = entry
+
+        recompiler = recompiler_of(interpreter)
+        if recompiler is None:
+            return
+        if recompiler.memory_buffer is not memory:
+            recompiler.reset()
+        for block in analysis['blocks']:
+            # Damaged blocks are compiled again when they are reached
+            try:
+                start, end, length, source, write_length, code, handlers = block
+                if not 0 <= start < end <= len(memory) or not set(handlers.values()) <= recompiler.handler_terminators:
+                    continue
+                code = marshal.loads(code)
+                if not isinstance(code, types.CodeType):
+                    continue
+                recompiler.install_block(start, end, length, source, write_length, code, handlers)
+            except (ValueError, EOFError, TypeError, KeyError, AttributeError):
+                continue
+
+    def save_analysis(self, interpreter):
+        """Adds everything decoded or compiled from the current ROM's original bytes to its saved analysis"""
+        if self.rom_hash is None or interpreter.rom_hash.hex() != self.rom_hash:
+            return
+        image = self.image
+        memory = interpreter.memory_buffer
+        analysis = self.read_analysis(self.rom_hash) or {'instructions': [], 'blocks': []}
+
+        # Code the program wrote itself is decoded again every run, it may differ next time
+        instructions = dict(analysis['instructions'])
+        for address, entry in enumerate(interpreter.decode_cache):
+            if entry is not None and memory[address:address + 2] == image[address:address + 2]:
+                instructions[address] = entry[0].__name__
+
+        blocks = {block[0]: block for block in analysis['blocks']}
+        recompiler = recompiler_of(interpreter)
+        if recompiler is not None and recompiler.memory_buffer is memory:
+            for block in recompiler.blocks:
+                if block is not None and memory[block.start:block.end] == image[block.start:block.end]:
+                    blocks[block.start] = (block.start, block.end, block.length, block.source, block.write_length,
+                                           marshal.dumps(block.code), block.handlers)
+
+        analysis = {
+            'version': ANALYSIS_VERSION,
+            'python': PYTHON_VERSION,
+            'instructions': sorted(instructions.items()),
+            'blocks': [blocks[start] for start in sorted(blocks)],
+        }
+        filename = self.analysis_file(self.rom_hash)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + '.tmp', 'wb') as file:
+            marshal.dump(analysis, file)
+        os.replace(filename + '.tmp', filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rom_library', description='Manage the ROM library')
+    parser.add_argument('-d', '--directory', help='library directory (default: ~/.chip8/library)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list the known ROMs')
+    add = commands.add_parser('add', help='add a ROM or change its metadata')
+    add.add_argument('rom', help='path to the ROM file')
+    add.add_argument('-t', '--title', help='title shown in the window')
+    add.add_argument('-c', '--clock-rate', type=int, help='preferred instructions per second')
+    args = parser.parse_args(argv)
+
+    library = RomLibrary(args.directory)
+    if args.command == 'add':
+        try:
+            with open(args.rom, 'rb') as file:
+                program = file.read()
+        except IOError as error:
+            print("Couldn't open file: " + str(error), file=sys.stderr)
+            return 1
+        library.add(program, args.rom)
+        metadata = {name: value for name, value in [('title', args.title), ('clock_rate', args.clock_rate)]
+                    if value is not None}
+        library.update(hashlib.sha1(program).hexdigest(), **metadata)
+        return 0
+
+    print("%-40s %6s %10s %s" % ("SHA-1", "Size", "Clock", "Title"))
+    for rom_hash, entry in sorted(library.roms.items(), key=lambda item: item[1]['title'].lower()):
+        analysed = os.path.isfile(library.analysis_file(rom_hash))
+        print("%-40s %6d %10s %s%s" % (rom_hash, entry['size'], entry['clock_rate'] or '-', entry['title'],
+                                       '' if analysed else ' (not analysed)'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import struct
+from framebuffer import Framebuffer
+
+# Binary save state layout, all fields are little-endian:
+#   header     magic, format version, SHA-1 of the ROM
+#   registers  PC, I, DT, ST, SP, Fx0A wait flag and register, keypad key and state, instruction count,
+#              cycle balance
+#   frames     timer ticks since the ROM was loaded (version 2)
+#   stack      16 addresses
+#   rng        Mersenne Twister state (624 words and the position), Gaussian flag and value
+#   sizes      memory size, framebuffer width and height (32-bit memory size from version 3, XO-CHIP has 64 KB)
+# SP counts the addresses on the stack from version 4, earlier states stored the index of the top one from stack[1]
+# followed by the raw memory, V registers, packed framebuffer bytes and SUPER-CHIP flag registers (version 3)
+MAGIC = b'C8SS'
+VERSION = 4
+HEADER = struct.Struct('<4sH20s')
+REGISTERS = struct.Struct('<HHBBB?BB?Qd')
+# Registers in version 1 to 3 states, the stack pointer was signed
+OLD_REGISTERS = struct.Struct('<HHBBb?BB?Qd')
+FRAMES = struct.Struct('<Q')
+STACK = struct.Struct('<16H')
+RNG = struct.Struct('<625I?d')
+SIZES = struct.Struct('<IHH')
+# Sizes in version 1 and 2 states
+OLD_SIZES = struct.Struct('<HHH')
+FLAGS = 16
+
+
+class SaveStateError(ValueError):
+    """Raised when a save state can't be restored"""
+
+
+def save(interpreter):
+    """Serializes the interpreter state to bytes"""
+    keyboard = interpreter.keyboard
+    framebuffer = interpreter.framebuffer
+    rng_version, rng_state, gauss_next = interpreter.random.getstate()
+    return b''.join([
+        HEADER.pack(MAGIC, VERSION, interpreter.rom_hash),
+        REGISTERS.pack(interpreter.program_counter, interpreter.register_i, interpreter.register_d,
+                       interpreter.register_s, interpreter.stack_pointer, interpreter.wait_for_key, interpreter.x,
+                       keyboard.key, keyboard.keydown, interpreter.instruction_count, interpreter.cycle_balance),
+        FRAMES.pack(interpreter.frame_count),
+        STACK.pack(*interpreter.stack),
+        RNG.pack(*rng_state, gauss_next is not None, gauss_next or 0.0),
+        SIZES.pack(len(interpreter.memory_buffer), framebuffer.width, framebuffer.height),
+        interpreter.memory_buffer,
+        interpreter.register_v,
+        framebuffer.buffer,
+        interpreter.flags,
+    ])
+
+
+def load(interpreter, data):
+    """Restores a state created by save, the interpreter must have the same ROM loaded"""
+    if len(data) < HEADER.size:
+        raise SaveStateError("Not a save state")
+    magic, version, rom_hash = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SaveStateError("Not a save state")
+    if version not in (1, 2, 3, VERSION):
+        raise SaveStateError("Unsupported save state version " + str(version))
+    if rom_hash != interpreter.rom_hash:
+        raise SaveStateError("Save state was created with a different ROM")
+    offset = HEADER.size
+    try:
+        registers_struct = REGISTERS if version >= 4 else OLD_REGISTERS
+        registers = registers_struct.unpack_from(data, offset)
+        offset += registers_struct.size
+        # Version 1 states didn't count frames
+        frame_count = 0
+        if version >= 2:
+            frame_count, = FRAMES.unpack_from(data, offset)
+            offset += FRAMES.size
+        stack = STACK.unpack_from(data, offset)
+        offset += STACK.size
+        if version < 4:
+            # The stack pointer keeps its value once the unused first entry is dropped
+            if not 0 <= registers[4] < len(stack):
+                raise SaveStateError("Save state has an invalid stack pointer")
+            stack = stack[1:] + (0,)
+        rng = RNG.unpack_from(data, offset)
+        offset += RNG.size
+        sizes = SIZES if version >= 3 else OLD_SIZES
+        memory_size, width, height = sizes.unpack_from(data, offset)
+        offset += sizes.size
+    except struct.error:
+        raise SaveStateError("Save state is truncated")
+    framebuffer = Framebuffer(width, height)
+    # Older states predate the flag registers
+    flags_size = FLAGS if version >= 3 else 0
+    if len(data) != offset + memory_size + 16 + len(framebuffer.buffer) + flags_size:
+        raise SaveStateError("Save state is truncated")
+
+    (interpreter.program_counter, interpreter.register_i, interpreter.register_d, interpreter.register_s,
+     interpreter.stack_pointer, interpreter.wait_for_key, interpreter.x, interpreter.keyboard.key,
+     interpreter.keyboard.keydown, interpreter.instruction_count, interpreter.cycle_balance) = registers
+    interpreter.frame_count = frame_count
+    interpreter.stack = list(stack)
+    interpreter.random.setstate((3, rng[:625], rng[626] if rng[625] else None))
+
+    # New buffers rather than copies into the old ones, so engines caching code from memory start over
+    interpreter.memory_buffer = bytearray(data[offset:offset + memory_size])
+    offset += memory_size
+    interpreter.register_v = bytearray(data[offset:offset + 16])
+    offset += 16
+    framebuffer.buffer[:] = data[offset:offset + len(framebuffer.buffer)]
+    offset += len(framebuffer.buffer)
+    interpreter.flags = bytearray(data[offset:offset + flags_size].ljust(FLAGS, b'\0'))
+    interpreter.framebuffer = framebuffer
+    interpreter.decode_cache = [None] * memory_size
+    interpreter.error = False
+
+    # Redraw the whole screen, the renderer uploads it in one go
+    interpreter.display.clear_screen()
+    interpreter.display.update_rows(framebuffer, range(height))
+    interpreter.audio.set_tone(interpreter.register_s > 0)
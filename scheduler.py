@@ -0,0 +1,190 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import math
+import time
+
+
+class CycleController:
+    def __init__(self, min_cycles=10, max_cycles=100000, cpu_fraction=0.8, smoothing=0.25):
+        """Chooses how many instructions a frame may execute so it finishes before its deadline. The cost of an
+        instruction is measured from recent frames, sprite heavy frames cost far more than ALU ones. """
+        # Bounds on the budget of a single frame
+        self.min_cycles = min_cycles
+        self.max_cycles = max_cycles
+        # Fraction of each frame period the CPU may use, the rest is left for the host
+        self.cpu_fraction = cpu_fraction
+        # Weight of the newest frame in the running cost estimate
+        self.smoothing = smoothing
+        # The budget grows at most by this factor per frame, so a run of cheap frames can't set up a long one
+        self.max_growth = 2.0
+        # Budget of the first frame, before any cost has been measured
+        self.initial_cycles = 1000
+
+        self.reset()
+
+    def reset(self):
+        # Estimated seconds per executed instruction, None until a frame has been measured
+        self.cost = None
+        # Budget chosen for the last frame
+        self.cycles = self.min_cycles
+
+    def budget(self, period, target):
+        """Instructions the next frame may execute, at most target"""
+        if self.cost is None:
+            cycles = min(target, self.initial_cycles)
+        else:
+            cycles = min(target, int(period * self.cpu_fraction / self.cost), int(self.cycles * self.max_growth) + 1)
+        self.cycles = max(self.min_cycles, min(self.max_cycles, cycles))
+        return self.cycles
+
+    def record(self, instructions, elapsed):
+        """Adds a frame which executed the given number of instructions in elapsed seconds to the estimate"""
+        if instructions <= 0:
+            return
+        cost = elapsed / instructions
+        if self.cost is None:
+            self.cost = cost
+        else:
+            self.cost += (cost - self.cost) * self.smoothing
+
+
+class Scheduler:
+    def __init__(self, interpreter, clock_rate=600, controller=None):
+        """Runs the interpreter against the wall clock, one emulated frame per 60 Hz timer tick"""
+        self.interpreter = interpreter
+        # Instructions per second, None runs the CPU as fast as possible
+        self.clock_rate = clock_rate
+        # Timer ticks per second of emulated time
+        self.timer_rate = 60
+        # Fast forward multiplier applied to emulated time
+        self.speed = 1.0
+        # Limits each frame's instructions to what the host can run in time. A host which can't keep up with the
+        # clock rate runs the program slower instead of dropping frames.
+        self.controller = controller or CycleController()
+        # Whether frames are running fewer instructions than the clock rate asks for, only changes after
+        # report_frames frames in the other state so a single slow frame isn't reported
+        self.limited = False
+        self.report_frames = 60
+        self.pending_frames = 0
+        # Frames which may be caught up in one update before the schedule is reset
+        self.max_frames_behind = 5
+        # Instructions an unlimited CPU runs between checks for an idle loop
+        self.unlimited_chunk = 1000
+
+        # Wall clock time at which the next frame is due
+        self.next_frame = None
+
+        # Statistics
+        self.frames_run = 0
+        self.frames_dropped = 0
+
+        self.set_clock_rate(clock_rate)
+
+    def set_clock_rate(self, clock_rate):
+        self.clock_rate = clock_rate
+        if clock_rate is not None:
+            self.interpreter.clock_rate = clock_rate
+        self.limited = False
+        self.pending_frames = 0
+
+    def set_speed(self, speed):
+        """Sets the fast forward multiplier, the schedule restarts so no frames are caught up"""
+        self.speed = speed
+        self.reset()
+
+    def reset(self):
+        self.next_frame = None
+
+    def frame_period(self):
+        return 1.0 / (self.timer_rate * self.speed)
+
+    def update(self):
+        """Runs every frame which is due, returns the number of frames that were run"""
+        now = time.perf_counter()
+        period = self.frame_period()
+        if self.next_frame is None:
+            self.next_frame = now
+        frames = 0
+        while now >= self.next_frame:
+            if frames >= self.max_frames_behind:
+                # The host can't keep up, drop the missed frames instead of trying to catch up forever
+                self.frames_dropped += int((now - self.next_frame) / period) + 1
+                self.next_frame = now + period
+                break
+            self.run_frame(period)
+            # Deadlines are absolute, so rounding in the host's timers doesn't accumulate as drift
+            self.next_frame += period
+            frames += 1
+            now = time.perf_counter()
+        self.frames_run += frames
+        return frames
+
+    def run_frame(self, period):
+        """Runs a single frame of emulated time"""
+        interpreter = self.interpreter
+        controller = self.controller
+        start = time.perf_counter()
+        instruction_count = interpreter.instruction_count
+        idle_cycles = interpreter.idle_cycles
+        if self.clock_rate is not None:
+            target = math.ceil(interpreter.cycle_balance + interpreter.clock_rate / self.timer_rate)
+            budget = controller.budget(period, target)
+            interpreter.run_frame(budget)
+            self.set_limited(budget < target)
+        else:
+            # Runs the frame's budget in chunks, polling the keypad before each one. A program waiting in an idle
+            # loop can't get anywhere before the next tick, so the rest of the budget is given back to the host.
+            remaining = controller.budget(period, controller.max_cycles)
+            while remaining > 0 and not interpreter.error:
+                executed = interpreter.run_cycles(min(remaining, self.unlimited_chunk))
+                remaining -= executed
+                if executed == 0 or interpreter.idle:
+                    break
+            interpreter.tick_timers()
+        # Skipped idle loops cost nothing and would make instructions look cheaper than they are
+        executed = interpreter.instruction_count - instruction_count - (interpreter.idle_cycles - idle_cycles)
+        controller.record(executed, time.perf_counter() - start)
+
+    def set_limited(self, limited):
+        """Reports when the host starts or stops keeping up with the clock rate"""
+        if limited == self.limited:
+            self.pending_frames = 0
+            return
+        self.pending_frames += 1
+        if self.pending_frames < self.report_frames:
+            return
+        if limited:
+            print("Host can't keep up with %d Hz, running about %d instructions per frame" % (
+                self.clock_rate, self.controller.cycles))
+        else:
+            print("Host is keeping up with %d Hz again" % self.clock_rate)
+        self.limited = limited
+        self.pending_frames = 0
+
+    def delay(self):
+        """Milliseconds until the next frame is due"""
+        if self.next_frame is None:
+            return 0
+        return max(0, math.ceil((self.next_frame - time.perf_counter()) * 1000))
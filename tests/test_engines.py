@@ -0,0 +1,144 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import io
+import os
+import random
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import headless
+
+# Seeds of the generated ROMs, each one is run on every engine
+SEEDS = range(12)
+
+
+def generate_rom(seed, length=200):
+    """Builds a random but mostly well formed classic Chip-8 ROM: loads point into the ROM or the font, calls are
+    followed by returns and the program loops back to the start when it falls off the end"""
+    rng = random.Random(seed)
+    end = 0x200 + 2 * length
+    opcodes = []
+    for _ in range(length):
+        x = rng.randrange(16)
+        y = rng.randrange(16)
+        kk = rng.randrange(256)
+        kind = rng.choice('0123456789ABCDEF')
+        if kind == '0':
+            opcodes.append(0x00E0)
+        elif kind == '1':
+            opcodes.append(0x1000 | rng.randrange(0x200, end, 2))
+        elif kind == '2':
+            opcodes.extend([0x2000 | rng.randrange(0x200, end, 2), 0x00EE])
+        elif kind in '345':
+            opcodes.append(int(kind, 16) << 12 | x << 8 | (y << 4 if kind == '5' else kk))
+        elif kind in '67C':
+            opcodes.append(int(kind, 16) << 12 | x << 8 | kk)
+        elif kind == '8':
+            opcodes.append(0x8000 | x << 8 | y << 4 | rng.choice([0, 1, 2, 3, 4, 5, 6, 7, 0xE]))
+        elif kind == '9':
+            opcodes.append(0x9000 | x << 8 | y << 4)
+        elif kind == 'A':
+            opcodes.append(0xA000 | rng.choice([0x000, 0x050, rng.randrange(0x200, end), 0x600]))
+        elif kind == 'B':
+            opcodes.append(0xB000 | rng.randrange(0x200, end - 0x100, 2))
+        elif kind == 'D':
+            opcodes.append(0xD000 | x << 8 | y << 4 | rng.randrange(1, 16))
+        elif kind == 'E':
+            opcodes.append(0xE000 | x << 8 | rng.choice([0x9E, 0xA1]))
+        else:
+            opcodes.append(0xF000 | x << 8 | rng.choice([0x07, 0x15, 0x18, 0x1E, 0x29, 0x33, 0x55, 0x65]))
+    opcodes.append(0x1200)
+    return benchmark.words(*opcodes)
+
+
+# ROMs which stop with a ROM error, every engine has to stop on the same instruction
+failures = {
+    'runaway': benchmark.words(0x1FFE),
+    'jump_past_memory': benchmark.words(0x6000, 0xBFFF),
+    'stack_underflow': benchmark.words(0x6001, 0x00EE),
+    'stack_overflow': benchmark.words(0x7001, 0x2200),
+    'bcd_past_memory': benchmark.words(0xAFFE, 0xF033),
+    'store_past_memory': benchmark.words(0xAFF8, 0xFF55),
+    'unknown_opcode': benchmark.words(0x6001, 0xE000),
+}
+
+# The generated ROMs followed by the benchmark workloads and the failing ROMs
+programs = ([generate_rom(seed) for seed in SEEDS] +
+            [benchmark.assemble(sections) for sections in benchmark.workloads.values()] + list(failures.values()))
+names = ['seed%d' % seed for seed in SEEDS] + list(benchmark.workloads) + list(failures)
+
+
+def state(interpreter):
+    """The parts of a machine which have to match between engines"""
+    return {
+        'V': bytes(interpreter.register_v),
+        'I': interpreter.register_i,
+        'PC': interpreter.program_counter,
+        'SP': interpreter.stack_pointer,
+        'stack': list(interpreter.stack),
+        'DT': interpreter.register_d,
+        'ST': interpreter.register_s,
+        'memory': bytes(interpreter.memory_buffer),
+        'framebuffer': bytes(interpreter.framebuffer.buffer),
+        'error': interpreter.error,
+        'wait': interpreter.wait_for_key,
+    }
+
+
+def create(engine, program):
+    interpreter = headless.create_interpreter(engine=engine, seed=0)
+    interpreter.load_program_to_memory(io.BytesIO(program))
+    return interpreter
+
+
+@pytest.mark.parametrize('program', programs, ids=names)
+def test_recompiler_matches_interpreter(program):
+    """Steps the recompiler a block at a time and catches the interpreter up to the same instruction count. Errors
+    have to stop both engines on the same instruction."""
+    scalar = create('interpreter', program)
+    compiled = create('recompiler', program)
+    keys = random.Random(1)
+    for _ in range(3000):
+        if keys.random() < 0.05:
+            scalar.keyboard.key = compiled.keyboard.key = keys.randrange(16)
+            scalar.keyboard.keydown = compiled.keyboard.keydown = keys.random() < 0.5
+        compiled.execute_cycles(1)
+        while scalar.instruction_count < compiled.instruction_count and not scalar.error:
+            scalar.execute_instruction()
+        assert scalar.instruction_count == compiled.instruction_count
+        assert state(scalar) == state(compiled)
+        assert scalar.errors == compiled.errors
+        if scalar.error or scalar.wait_for_key:
+            break
+
+
+@pytest.mark.parametrize('program', programs, ids=names)
+def test_vector_engine_matches_interpreter(program):
+    """Runs a batch of differently seeded machines in lockstep with scalar interpreters"""
+    vector_engine = pytest.importorskip('vector_engine')
+    assert vector_engine.check(program, count=8, frames=60, seed=0, key_seed=1) == []
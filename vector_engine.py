@@ -0,0 +1,431 @@
+"""
+MIT License
+
+Copyright (c) 2020 Chris Bell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import hashlib
+import io
+import random
+import sys
+import time
+import numpy as np
+import headless
+from interpreter import Interpreter
+
+# Sprite bytes are shifted to the top of a 64-bit row before being rotated into place
+SPRITE_SHIFT = np.uint64(56)
+ROW_BITS = np.uint64(64)
+
+
+class VectorEngine:
+    def __init__(self, count, seed=0, clock_rate=600):
+        """Runs count independent Chip-8 machines in lockstep. Machine state is stored as arrays with one row per
+        machine and every step executes one instruction on all of them, grouped by opcode. Machine m behaves exactly
+        like an Interpreter created with seed + m, ROM errors included. Only Chip-8 is supported, SUPER-CHIP and
+        XO-CHIP instructions stop the machine with its error flag set. """
+        self.count = count
+        self.seed = seed
+        # Emulated CPU speed in instructions per second, shared by all machines
+        self.clock_rate = clock_rate
+
+        # Machine state, one row per machine
+        self.memory = np.zeros((count, 4096), np.uint8)
+        self.register_v = np.zeros((count, 16), np.uint8)
+        self.register_i = np.zeros(count, np.int64)
+        self.register_d = np.zeros(count, np.int64)
+        self.register_s = np.zeros(count, np.int64)
+        self.program_counter = np.full(count, 0x200, np.int64)
+        # Number of addresses on each machine's stack
+        self.stack_pointer = np.zeros(count, np.int64)
+        self.stack = np.zeros((count, 16), np.int64)
+        # Each row is a 64 pixel word, the most significant bit is the leftmost pixel
+        self.framebuffer = np.zeros((count, 32), np.uint64)
+
+        # Keypad of each machine, set by the caller between frames
+        self.key = np.zeros(count, np.int64)
+        self.keydown = np.zeros(count, bool)
+
+        # Used for Fx0A
+        self.wait_for_key = np.zeros(count, bool)
+        self.x = np.zeros(count, np.int64)
+
+        # Machines which hit an invalid instruction or memory access stop, the others carry on
+        self.error = np.zeros(count, bool)
+        # Machines which stopped on a SUPER-CHIP or XO-CHIP instruction, the interpreter would have run it
+        self.unsupported = np.zeros(count, bool)
+
+        self.cycle_balance = np.zeros(count, np.float64)
+        self.instruction_count = np.zeros(count, np.int64)
+
+        # Cxkk draws from one generator per machine, so the sequence matches the interpreter's
+        self.random = [random.Random(seed + machine) for machine in range(count)]
+
+        self.memory[:, :len(Interpreter.font)] = np.frombuffer(Interpreter.font, np.uint8)
+
+    def load_program(self, program):
+        """Resets every machine and loads the same program into each of them"""
+        self.__init__(self.count, self.seed, self.clock_rate)
+        if len(program) > 4096 - 0x200:
+            # Only XO-CHIP programs are this large
+            self.error[:] = True
+            self.unsupported[:] = True
+            return
+        self.memory[:, 0x200:0x200 + len(program)] = np.frombuffer(program, np.uint8)
+
+    def framebuffer_bytes(self, machine):
+        """The machine's screen in the interpreter's packed framebuffer layout"""
+        return self.framebuffer[machine].astype('>u8').tobytes()
+
+    def framebuffer_hash(self, machine):
+        return hashlib.sha1(self.framebuffer_bytes(machine)).hexdigest()
+
+    def run_frame(self):
+        """Executes one 60 Hz frame on every machine, clock_rate / 60 instructions followed by a timer tick"""
+        self.cycle_balance += self.clock_rate / 60
+        budget = np.maximum(self.cycle_balance.astype(np.int64), 0)
+
+        # Machines waiting in Fx0A continue once their key is down
+        resume = np.flatnonzero(self.wait_for_key & self.keydown)
+        self.register_v[resume, self.x[resume]] = self.key[resume]
+        self.program_counter[resume] += 2
+        self.wait_for_key[resume] = False
+
+        executed = np.zeros(self.count, np.int64)
+        for step in range(int(budget.max()) if self.count else 0):
+            active = np.flatnonzero(~self.error & ~self.wait_for_key & (budget > step))
+            if not len(active):
+                break
+            self.step(active)
+            executed[active] += 1
+
+        self.instruction_count += executed
+        self.cycle_balance -= executed
+        # Time spent waiting isn't owed to the program afterwards
+        self.cycle_balance[self.wait_for_key | self.error] = 0.0
+        self.tick_timers()
+
+    def tick_timers(self):
+        np.maximum(self.register_d - 1, 0, out=self.register_d)
+        np.maximum(self.register_s - 1, 0, out=self.register_s)
+
+    def step(self, machines):
+        """Executes the current instruction of each of the given machines"""
+        program_counter = self.program_counter[machines]
+        # The interpreter can't decode an instruction which runs past the end of memory
+        outside = program_counter > 0xFFE
+        if outside.any():
+            self.error[machines[outside]] = True
+            machines = machines[~outside]
+            program_counter = program_counter[~outside]
+
+        memory = self.memory
+        opcode = memory[machines, program_counter].astype(np.int64) << 8 | memory[machines, program_counter + 1]
+        upper_bits = opcode >> 12
+        next_pc = program_counter + 2
+        error = np.zeros(len(machines), bool)
+
+        groups = np.bincount(upper_bits, minlength=16)
+        for group in np.flatnonzero(groups):
+            selected = np.flatnonzero(upper_bits == group)
+            getattr(self, self.groups[group])(machines[selected], opcode[selected], program_counter[selected],
+                                              selected, next_pc, error)
+
+        self.error[machines[error]] = True
+        self.unsupported[machines[error]] |= self.extended_opcode(opcode[error])
+        keep = ~error
+        self.program_counter[machines[keep]] = next_pc[keep]
+
+    @staticmethod
+    def extended_opcode(opcode):
+        """Which of the opcodes are SUPER-CHIP or XO-CHIP instructions"""
+        upper_bits = opcode >> 12
+        low_byte = opcode & 0xFF
+        return (((opcode & 0xFFE0) == 0x00C0) | ((opcode >= 0x00FB) & (opcode <= 0x00FF)) |
+                ((upper_bits == 0x5) & ((opcode & 0xF) >= 2) & ((opcode & 0xF) <= 3)) |
+                ((upper_bits == 0xD) & ((opcode & 0xF) == 0)) | (opcode == 0xF000) |
+                ((upper_bits == 0xF) & ((low_byte == 0x30) | (low_byte == 0x75) | (low_byte == 0x85))))
+
+    # Handler for each value of the upper 4 bits, called with the machines, their opcodes and program counters,
+    # the positions of the machines in the step and the step's next program counters and error flags
+    groups = ['_0nnn', '_1nnn', '_2nnn', '_3xkk', '_4xkk', '_5xy0', '_6xkk', '_7xkk',
+              '_8xyn', '_9xy0', '_Annn', '_Bnnn', '_Cxkk', '_Dxyn', '_Exkk', '_Fxkk']
+
+    def _0nnn(self, machines, opcode, program_counter, selected, next_pc, error):
+        """00E0 clears the screen, 00EE returns from a subroutine, 0nnn is ignored"""
+        error[selected[self.extended_opcode(opcode)]] = True
+        self.framebuffer[machines[opcode == 0x00E0]] = 0
+        returning = opcode == 0x00EE
+        if returning.any():
+            machines = machines[returning]
+            selected = selected[returning]
+            stack_pointer = self.stack_pointer[machines] - 1
+            valid = stack_pointer >= 0
+            error[selected[~valid]] = True
+            machines = machines[valid]
+            next_pc[selected[valid]] = self.stack[machines, stack_pointer[valid]] + 2
+            self.stack_pointer[machines] = stack_pointer[valid]
+
+    def _1nnn(self, machines, opcode, program_counter, selected, next_pc, error):
+        next_pc[selected] = opcode & 0xFFF
+
+    def _2nnn(self, machines, opcode, program_counter, selected, next_pc, error):
+        stack_pointer = self.stack_pointer[machines]
+        valid = stack_pointer < 16
+        error[selected[~valid]] = True
+        machines = machines[valid]
+        self.stack[machines, stack_pointer[valid]] = program_counter[valid]
+        self.stack_pointer[machines] = stack_pointer[valid] + 1
+        next_pc[selected[valid]] = opcode[valid] & 0xFFF
+
+    def _3xkk(self, machines, opcode, program_counter, selected, next_pc, error):
+        next_pc[selected] += 2 * (self.register_v[machines, opcode >> 8 & 0xF] == (opcode & 0xFF))
+
+    def _4xkk(self, machines, opcode, program_counter, selected, next_pc, error):
+        next_pc[selected] += 2 * (self.register_v[machines, opcode >> 8 & 0xF] != (opcode & 0xFF))
+
+    def _5xy0(self, machines, opcode, program_counter, selected, next_pc, error):
+        error[selected[self.extended_opcode(opcode)]] = True
+        registers = self.register_v
+        next_pc[selected] += 2 * (registers[machines, opcode >> 8 & 0xF] == registers[machines, opcode >> 4 & 0xF])
+
+    def _9xy0(self, machines, opcode, program_counter, selected, next_pc, error):
+        registers = self.register_v
+        next_pc[selected] += 2 * (registers[machines, opcode >> 8 & 0xF] != registers[machines, opcode >> 4 & 0xF])
+
+    def _6xkk(self, machines, opcode, program_counter, selected, next_pc, error):
+        self.register_v[machines, opcode >> 8 & 0xF] = opcode & 0xFF
+
+    def _7xkk(self, machines, opcode, program_counter, selected, next_pc, error):
+        x = opcode >> 8 & 0xF
+        self.register_v[machines, x] = (self.register_v[machines, x] + (opcode & 0xFF)) & 0xFF
+
+    def _8xyn(self, machines, opcode, program_counter, selected, next_pc, error):
+        """Every 8xyn result is computed and the one selected by n is kept, VF is written last"""
+        x = opcode >> 8 & 0xF
+        n = opcode & 0xF
+        vx = self.register_v[machines, x].astype(np.int64)
+        vy = self.register_v[machines, opcode >> 4 & 0xF].astype(np.int64)
+        cases = [n == 0x0, n == 0x1, n == 0x2, n == 0x3, n == 0x4, n == 0x5, n == 0x6, n == 0x7, n == 0xE]
+        result = np.select(cases, [vy, vx | vy, vx & vy, vx ^ vy, vx + vy, vx - vy, vx >> 1, vy - vx, vx << 1]) & 0xFF
+        flag = np.select(cases[4:], [vx + vy >> 8, vx >= vy, vx & 1, vy >= vx, vx >> 7])
+        valid = np.any(cases, axis=0)
+        error[selected[~valid]] = True
+        self.register_v[machines[valid], x[valid]] = result[valid]
+        flagged = np.any(cases[4:], axis=0)
+        self.register_v[machines[flagged], 0xF] = flag[flagged]
+
+    def _Annn(self, machines, opcode, program_counter, selected, next_pc, error):
+        self.register_i[machines] = opcode & 0xFFF
+
+    def _Bnnn(self, machines, opcode, program_counter, selected, next_pc, error):
+        next_pc[selected] = ((opcode & 0xFFF) + self.register_v[machines, 0]) & 0xFFF
+
+    def _Cxkk(self, machines, opcode, program_counter, selected, next_pc, error):
+        # Each machine's generator is advanced in the same order as the interpreter would
+        generators = self.random
+        registers = self.register_v
+        for machine, word in zip(machines.tolist(), opcode.tolist()):
+            registers[machine, word >> 8 & 0xF] = generators[machine].randint(0, 255) & word & 0xFF
+
+    def _Dxyn(self, machines, opcode, program_counter, selected, next_pc, error):
+        """Draws the sprites one row at a time across all the machines, VF is set to the collision flag"""
+        registers = self.register_v
+        framebuffer = self.framebuffer
+        x = (registers[machines, opcode >> 8 & 0xF] % 64).astype(np.uint64)
+        y = registers[machines, opcode >> 4 & 0xF].astype(np.int64)
+        n = opcode & 0xF
+        address = self.register_i[machines]
+        error[selected[n == 0]] = True
+        collision = np.zeros(len(machines), bool)
+        for j in range(int(n.max())):
+            # Sprites are cut short at the end of memory like the interpreter's slice
+            drawn = np.flatnonzero((j < n) & (address + j < 4096))
+            if not len(drawn):
+                break
+            rows = machines[drawn]
+            sprite_row = self.memory[rows, address[drawn] + j].astype(np.uint64) << SPRITE_SHIFT
+            shift = x[drawn]
+            # Rotating by (64 - x) % 64 keeps the shift in range when x is 0
+            bits = sprite_row >> shift | sprite_row << ((ROW_BITS - shift) % ROW_BITS)
+            screen_row = (y[drawn] + j) % 32
+            old = framebuffer[rows, screen_row]
+            collision[drawn] |= (old & bits) != 0
+            framebuffer[rows, screen_row] = old ^ bits
+        registers[machines, 0xF] = collision
+
+    def _Exkk(self, machines, opcode, program_counter, selected, next_pc, error):
+        byte = opcode & 0xFF
+        pressed = self.keydown[machines] & (self.key[machines] == self.register_v[machines, opcode >> 8 & 0xF])
+        next_pc[selected] += 2 * np.where(byte == 0x9E, pressed, ~pressed)
+        error[selected[(byte != 0x9E) & (byte != 0xA1)]] = True
+
+    def _Fxkk(self, machines, opcode, program_counter, selected, next_pc, error):
+        byte = opcode & 0xFF
+        x = opcode >> 8 & 0xF
+        registers = self.register_v
+        memory = self.memory
+        for value in np.unique(byte).tolist():
+            chosen = byte == value
+            group = machines[chosen]
+            group_x = x[chosen]
+            if value == 0x07:
+                registers[group, group_x] = self.register_d[group]
+            elif value == 0x0A:
+                self.wait_for_key[group] = True
+                self.x[group] = group_x
+                next_pc[selected[chosen]] = program_counter[chosen]
+            elif value == 0x15:
+                self.register_d[group] = registers[group, group_x]
+            elif value == 0x18:
+                self.register_s[group] = registers[group, group_x]
+            elif value == 0x1E:
+                self.register_i[group] = (self.register_i[group] + registers[group, group_x]) & 0xFFFF
+            elif value == 0x29:
+                self.register_i[group] = (registers[group, group_x] & 0xF) * 5
+            elif value == 0x33:
+                address = self.register_i[group]
+                valid = address + 2 < 4096
+                error[selected[chosen][~valid]] = True
+                group = group[valid]
+                address = address[valid]
+                decimal = registers[group, group_x[valid]]
+                memory[group, address] = decimal // 100
+                memory[group, address + 1] = decimal // 10 % 10
+                memory[group, address + 2] = decimal % 10
+            elif value == 0x55 or value == 0x65:
+                address = self.register_i[group]
+                valid = address + group_x + 1 <= 4096
+                error[selected[chosen][~valid]] = True
+                group = group[valid]
+                address = address[valid]
+                group_x = group_x[valid]
+                for register in range(int(group_x.max()) + 1 if len(group_x) else 0):
+                    copied = register <= group_x
+                    if value == 0x55:
+                        memory[group[copied], address[copied] + register] = registers[group[copied], register]
+                    else:
+                        registers[group[copied], register] = memory[group[copied], address[copied] + register]
+            else:
+                error[selected[chosen]] = True
+
+
+def create_interpreters(count, seed, clock_rate, program):
+    """Scalar interpreters matching the machines of a VectorEngine, used to check it"""
+    interpreters = []
+    for machine in range(count):
+        interpreter = headless.create_interpreter(seed=seed + machine)
+        interpreter.clock_rate = clock_rate
+        interpreter.load_program_to_memory(io.BytesIO(program))
+        interpreters.append(interpreter)
+    return interpreters
+
+
+def compare_machine(engine, machine, interpreter):
+    """Returns the names of the fields in which the machine differs from the interpreter"""
+    fields = [
+        ('memory', bytes(engine.memory[machine]), bytes(interpreter.memory_buffer)),
+        ('V', bytes(engine.register_v[machine]), bytes(interpreter.register_v)),
+        ('I', int(engine.register_i[machine]), interpreter.register_i),
+        ('DT', int(engine.register_d[machine]), interpreter.register_d),
+        ('ST', int(engine.register_s[machine]), interpreter.register_s),
+        ('PC', int(engine.program_counter[machine]), interpreter.program_counter),
+        ('SP', int(engine.stack_pointer[machine]), interpreter.stack_pointer),
+        ('stack', engine.stack[machine].tolist(), interpreter.stack),
+        ('framebuffer', engine.framebuffer_bytes(machine), bytes(interpreter.framebuffer.buffer)),
+        ('wait', bool(engine.wait_for_key[machine]), interpreter.wait_for_key),
+        ('error', bool(engine.error[machine]), interpreter.error),
+        ('instructions', int(engine.instruction_count[machine]), interpreter.instruction_count),
+        ('balance', float(engine.cycle_balance[machine]), interpreter.cycle_balance),
+    ]
+    return [name for name, vector_value, scalar_value in fields if vector_value != scalar_value]
+
+
+def check(program, count, frames, seed=0, clock_rate=600, key_seed=0):
+    """Runs the engine next to scalar interpreters with random keypad input, returns a list of mismatches. A machine
+    is no longer compared after its first mismatch. """
+    engine = VectorEngine(count, seed, clock_rate)
+    engine.load_program(program)
+    interpreters = create_interpreters(count, seed, clock_rate, program)
+    keys = random.Random(key_seed)
+    diverged = [False] * count
+    mismatches = []
+    for frame in range(frames):
+        for machine, interpreter in enumerate(interpreters):
+            if keys.random() < 0.1:
+                interpreter.keyboard.key = engine.key[machine] = keys.randrange(16)
+                interpreter.keyboard.keydown = engine.keydown[machine] = keys.random() < 0.5
+        engine.run_frame()
+        for machine, interpreter in enumerate(interpreters):
+            if diverged[machine] or engine.unsupported[machine]:
+                continue
+            interpreter.run_frame()
+            fields = compare_machine(engine, machine, interpreter)
+            if fields:
+                mismatches.append((frame, machine, fields))
+                diverged[machine] = True
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m vector_engine',
+                                     description='Run many copies of a Chip-8 ROM in lockstep')
+    parser.add_argument('rom', help='path to the ROM file')
+    parser.add_argument('-n', '--machines', type=int, default=1000, help='number of machines')
+    parser.add_argument('-f', '--frames', type=int, default=600, help='number of frames to execute')
+    parser.add_argument('-c', '--clock-rate', type=int, default=600, help='instructions per second of emulated time')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Cxkk seed of the first machine')
+    parser.add_argument('--check', action='store_true',
+                        help='compare every machine against the scalar interpreter instead of timing')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.rom, 'rb') as file:
+            program = file.read()
+    except IOError as error:
+        print("Couldn't open file: " + str(error), file=sys.stderr)
+        return 1
+
+    if args.check:
+        mismatches = check(program, args.machines, args.frames, args.seed, args.clock_rate)
+        for frame, machine, fields in mismatches[:20]:
+            print("Frame %d, machine %d differs in %s" % (frame, machine, ', '.join(fields)))
+        print("%d machines checked for %d frames, %d mismatches" % (args.machines, args.frames, len(mismatches)))
+        return 1 if mismatches else 0
+
+    engine = VectorEngine(args.machines, args.seed, args.clock_rate)
+    engine.load_program(program)
+    start = time.perf_counter()
+    for frame in range(args.frames):
+        engine.run_frame()
+    elapsed = time.perf_counter() - start
+    instructions = int(engine.instruction_count.sum())
+    print("Machines: %d (%d stopped with errors)" % (args.machines, int(engine.error.sum())))
+    print("Instructions: " + str(instructions))
+    print("Seconds: %.3f" % elapsed)
+    print("Instructions/second: %.0f" % (instructions / elapsed if elapsed > 0 else 0.0))
+    print("Framebuffer hash of machine 0: " + engine.framebuffer_hash(0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,39 +25,77 @@ SOFTWARE.
 from tkinter import messagebox
 from OpenGL.error import GLError
 from pyopengltk import OpenGLFrame
+from collections import deque
 import time
-import os
 import platform
+import subprocess
+from framebuffer import Framebuffer
+
+
+def set_key_repeat(on):
+    """Turns X11 key auto-repeat on or off, xset runs in the background so startup doesn't wait for it"""
+    if platform.system() != 'Linux':
+        return
+    try:
+        subprocess.Popen(['xset', 'r', 'on' if on else 'off'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        # xset isn't installed, key repeat is left as it is
+        return
 
 
 class Window(OpenGLFrame):
 
-    def __init__(self, master=None, display=0, interpreter=0, file_io=0, keymap=0, audio=0, cnf={}, **kw):
-        """The main tkinter window"""
+    def __init__(self, master=None, display=0, interpreter=0, file_io=0, keymap=0, audio=0, emulation=0, profiler=0,
+                 cnf={}, **kw):
+        """The main tkinter window, draws the newest frame from the emulation thread"""
         # Inherits from BaseOpenGLFrame
         super().__init__(master, cnf, **kw)
         # Actual window size
         self.window_width = kw['width']
         self.window_height = kw['height']
 
-        # Used for FPS calculations
-        self.start = time.time()
-        self.delta = 0
-
         self.display = display
         self.interpreter = interpreter
         self.file_io = file_io
         self.keymap = keymap
         self.audio = audio
-
-        if platform.system() == 'Linux':
-            os.system('xset r off')
+        self.emulation = emulation
+        self.profiler = profiler
+
+        # Framebuffer rows on screen, only rows which differ from the new frame are sent to the display
+        self.shown = None
+
+        # Times the window was drawn and new frames put on screen, compared with the emulation rate in the title
+        self.redraws = 0
+        self.frames_presented = 0
+        # (time, redraws, frames presented, frames run) samples covering the last rate_window seconds
+        self.rate_samples = deque()
+        self.rate_window = 1.0
+        self.display_rate = 0.0
+        self.presented_rate = 0.0
+        self.emulation_rate = 0.0
+        # The title is rebuilt at most every title_period seconds
+        self.title_period = 0.5
+        self.next_title = 0.0
+        self.title = None
+
+        # New frames are checked for at the display rate instead of pyopengltk's fixed animate interval, the window
+        # is only drawn when one changed the screen
+        self.animate = 0
+        self.display_period = 1 / 60
+        self.pending_tick = None
+
+        set_key_repeat(False)
 
     def initgl(self):
         """Compile the shaders and creates the vertex buffers"""
         try:
             self.display.bind_shader()
             self.display.create_vertex_objects()
+            self.display.resize(self.window_width, self.window_height)
+            # Called again on every resize, only one tick loop is kept
+            if self.pending_tick is None:
+                self.pending_tick = self.after(0, self.tick)
         except GLError as gl_error:
             # Format and show an error
             gl_error.format_description('description', gl_error.description)
@@ -65,30 +103,82 @@ class Window(OpenGLFrame):
                                  str.encode('%s' % gl_error.baseOperation.__name__))
             self.close()
 
-    def redraw(self):
-        """Main execution loop"""
-        if self.file_io.file_open and not self.interpreter.error:
-            # Check if executing Fx0A
-            if not self.interpreter.wait_for_key:
-                for i in range(self.interpreter.num_cycles):
-                    self.interpreter.execute_instruction()
-            elif self.keymap.keydown:
-                # Continue execution from opcode Fx0A
-                x = self.interpreter.x
-                self.interpreter.wait_for_key = False
-                self.interpreter.register_v[x] = self.keymap.key
-                self.interpreter.program_counter += 2
+    def tick(self):
+        """Picks up the newest frame from the emulation thread, the window is only drawn when the screen changed"""
+        frame = self.emulation.frames.latest()
+        if frame is not None and self.present(frame.framebuffer):
+            self._display()
+        self.update_title()
+        self.pending_tick = self.after(int(self.display_period * 1000), self.tick)
 
+    def redraw(self):
+        """Draws the screen, called for new frames and by pyopengltk whenever the window is exposed"""
         self.display.render()
-
-        # Update the FPS
-        end = time.time()
-        self.delta = end - self.start
-        self.start = end
-        self.master.title("Chip-8 Emulator " + "~ " + self.file_io.rom + " ~ FPS: " + str(int(1.0 / self.delta)))
+        self.redraws += 1
+
+    def present(self, framebuffer):
+        """Sends the rows which changed since the last frame to the display, returns whether there were any"""
+        shown = self.shown
+        if shown is None or len(shown.buffer) != len(framebuffer.buffer):
+            rows = range(framebuffer.height)
+            self.shown = Framebuffer(framebuffer.width, framebuffer.height)
+        else:
+            row_bytes = framebuffer.row_bytes
+            rows = [row for row in range(framebuffer.height)
+                    if shown.buffer[row * row_bytes:(row + 1) * row_bytes] !=
+                    framebuffer.buffer[row * row_bytes:(row + 1) * row_bytes]]
+            if not rows:
+                return False
+        self.display.update_rows(framebuffer, rows)
+        self.frames_presented += 1
+        # The frame goes back to the emulation thread on the next swap, so a copy is kept
+        self.shown.buffer[:] = framebuffer.buffer
+        return True
+
+    def measure_rates(self, now):
+        """Redraws, new frames on screen and emulated frames per second, averaged over the last rate_window
+        seconds """
+        samples = self.rate_samples
+        samples.append((now, self.redraws, self.frames_presented, self.emulation.statistics()['frames_run']))
+        while now - samples[0][0] > self.rate_window and len(samples) > 2:
+            samples.popleft()
+        then, redraws, presented, frames_run = samples[0]
+        if now > then:
+            self.display_rate = (self.redraws - redraws) / (now - then)
+            self.presented_rate = (self.frames_presented - presented) / (now - then)
+            self.emulation_rate = (samples[-1][3] - frames_run) / (now - then)
+
+    def update_title(self):
+        """Refreshes the FPS in the title, at most every title_period seconds and only when the text changed"""
+        now = time.perf_counter()
+        if now < self.next_title:
+            return
+        self.next_title = now + self.title_period
+        self.measure_rates(now)
+        title = "Chip-8 Emulator " + "~ " + self.file_io.rom + " ~ FPS: %.0f" % self.display_rate
+        statistics = self.emulation.statistics()
+        title += " ~ Emulation: %.0f fps ~ Budget: %d/frame" % (self.emulation_rate, statistics['cycles_per_frame'])
+        if statistics['limited']:
+            title += " (host limited)"
+        if statistics['failure']:
+            title += " ~ Stopped: " + statistics['failure']
+        if self.profiler.attached:
+            with self.emulation.lock:
+                title += " ~ " + self.profiler.overlay()
+        if title != self.title:
+            self.title = title
+            self.master.title(title)
+
+    def start_rewind(self, event=None):
+        self.emulation.rewinding = True
+
+    def stop_rewind(self, event=None):
+        self.emulation.rewinding = False
 
     def close(self):
-        if platform.system() == 'Linux':
-            os.system('xset r on')
+        self.emulation.stop()
+        self.file_io.save_analysis()
+        set_key_repeat(True)
         self.display.destroy()
+        self.audio.close()
         self.tk.quit()